@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+内容寻址的下载存储
+按 (平台, 视频ID, 格式ID, 后处理选项) 生成键，同一视频同一格式只下载和存储一次
+- 索引保存在SQLite中，记录大小、租约和最近访问时间
+- 下载在暂存目录完成后再原子地发布到objects目录
+- 并发请求同一个键时只有一个下载在进行，其余请求等待其结果（进程内和跨进程）
+- 每次导出使用唯一的文件名，并持有一个带过期时间的租约（与查询/发布在同一事务中取得），
+  调用方用完后释放（release）；调用方未释放时租约到期自动失效，总大小超过上限时按LRU淘汰没有有效租约的文件
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(__file__), '..', 'cache', 'downloads')
+DEFAULT_MAX_BYTES = int(os.environ.get('DOWNLOAD_STORE_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+# 导出文件的租约有效期（秒），调用方未释放时到期后条目可以被淘汰
+LEASE_TTL = int(os.environ.get('DOWNLOAD_LEASE_TTL', 3600))
+
+# 下载进行中的心跳间隔，超过STALE_AFTER没有心跳视为下载进程已退出
+HEARTBEAT_INTERVAL = 10
+STALE_AFTER = 60
+POLL_INTERVAL = 0.5
+
+
+def make_store_key(platform, video_id, format_id, options=None):
+    """生成存储键"""
+    raw = json.dumps([platform, video_id, str(format_id), options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+class DownloadStoreError(Exception):
+    """下载存储操作失败"""
+
+
+class _Flight:
+    """进程内一次进行中的下载，等待者共享其结果或错误"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+
+
+class DownloadStore:
+    """共享下载存储（多进程共享同一个目录和索引）"""
+
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = os.path.abspath(root or os.environ.get('DOWNLOAD_STORE_DIR', DEFAULT_STORE_DIR))
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.staging_root = os.path.join(self.root, 'staging')
+        self.index_path = os.path.join(self.root, 'index.db')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.staging_root, exist_ok=True)
+
+        # 进程内正在进行的下载：key -> _Flight
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    meta TEXT
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    id TEXT PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS leases_key ON leases (key)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS inflight (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    heartbeat REAL NOT NULL
+                )
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_staging_dir(self, name):
+        """按名称获取固定的暂存目录，中断后重试同一下载时可以复用其中的部分文件"""
+        staging_dir = os.path.join(self.staging_root, name)
+        os.makedirs(staging_dir, exist_ok=True)
+        return staging_dir
+
+    def discard_staging_dir(self, staging_dir):
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def lookup(self, key, lease=None):
+        """
+        查询已发布的条目，文件丢失时删除索引
+        指定lease时在同一事务中为条目取得该租约，查询和导出之间条目不会被淘汰
+        """
+        with self._connect() as conn:
+            # 立即加写锁，其它进程的淘汰不能插在查询和取得租约之间
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT * FROM entries WHERE key = ?', (key,)).fetchone()
+            if not row:
+                return None
+            if not os.path.exists(row['path']):
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            now = time.time()
+            conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+            if lease:
+                self._acquire(conn, key, lease, now)
+            entry = dict(row)
+        entry['meta'] = json.loads(entry['meta']) if entry['meta'] else {}
+        return entry
+
+    @staticmethod
+    def _acquire(conn, key, lease, now):
+        conn.execute('INSERT OR REPLACE INTO leases (id, key, expires_at) VALUES (?, ?, ?)',
+                     (lease, key, now + LEASE_TTL))
+
+    def release(self, lease):
+        """释放租约"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM leases WHERE id = ?', (lease,))
+
+    def _claim(self, key, owner):
+        """尝试成为该键的下载者，已有未超时的下载者时返回False"""
+        now = time.time()
+        with self._connect() as conn:
+            try:
+                conn.execute('INSERT INTO inflight (key, owner, heartbeat) VALUES (?, ?, ?)', (key, owner, now))
+                return True
+            except sqlite3.IntegrityError:
+                # 接管心跳超时的下载
+                cursor = conn.execute(
+                    'UPDATE inflight SET owner = ?, heartbeat = ? WHERE key = ? AND heartbeat < ?',
+                    (owner, now, key, now - STALE_AFTER))
+                return cursor.rowcount == 1
+
+    def _heartbeat(self, key, owner, stop_event):
+        while not stop_event.wait(HEARTBEAT_INTERVAL):
+            with self._connect() as conn:
+                conn.execute('UPDATE inflight SET heartbeat = ? WHERE key = ? AND owner = ?',
+                             (time.time(), key, owner))
+
+    def _unclaim(self, key, owner):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM inflight WHERE key = ? AND owner = ?', (key, owner))
+
+    def _is_inflight(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT heartbeat FROM inflight WHERE key = ?', (key,)).fetchone()
+        return bool(row) and row['heartbeat'] >= time.time() - STALE_AFTER
+
+    def fetch(self, key, producer, meta=None, wait_timeout=3600, lease=None):
+        """
+        获取键对应的文件，不存在时调用producer()下载
+        producer返回暂存目录中已下载完成的文件路径
+        指定lease时为返回的条目取得该租约（导出后由调用方释放）
+        返回 (条目, 是否命中已有文件)
+        """
+        deadline = time.time() + wait_timeout
+        owner = f'{os.getpid()}:{threading.get_ident()}'
+
+        while True:
+            entry = self.lookup(key, lease)
+            if entry:
+                return entry, True
+
+            # 进程内合并：同一个键只有一个线程下载
+            with self._inflight_lock:
+                flight = self._inflight.get(key)
+                is_leader = flight is None
+                if is_leader:
+                    flight = _Flight()
+                    self._inflight[key] = flight
+
+            if not is_leader:
+                flight.event.wait(max(0, deadline - time.time()))
+                if flight.error is not None:
+                    raise flight.error
+            elif self._claim(key, owner):
+                try:
+                    return self._produce(key, owner, producer, meta, lease), False
+                except Exception as e:
+                    flight.error = e
+                    raise
+                finally:
+                    with self._inflight_lock:
+                        self._inflight.pop(key, None)
+                    flight.event.set()
+            else:
+                # 其它进程正在下载，轮询直到其完成或放弃
+                try:
+                    while self._is_inflight(key) and time.time() < deadline:
+                        time.sleep(POLL_INTERVAL)
+                finally:
+                    with self._inflight_lock:
+                        self._inflight.pop(key, None)
+                    flight.event.set()
+
+            if time.time() >= deadline:
+                raise DownloadStoreError(f'Timed out waiting for in-flight download {key}')
+
+    def _produce(self, key, owner, producer, meta, lease):
+        stop_event = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(key, owner, stop_event), daemon=True)
+        heartbeat.start()
+        try:
+            file_path = producer()
+            if not file_path or not os.path.exists(file_path):
+                raise DownloadStoreError('Producer did not create a file')
+            return self._publish(key, file_path, meta, lease)
+        finally:
+            stop_event.set()
+            self._unclaim(key, owner)
+
+    def _publish(self, key, file_path, meta, lease=None):
+        """原子地把暂存文件移动到objects目录并写入索引（指定lease时在同一事务中取得租约）"""
+        filename = os.path.basename(file_path)
+        ext = os.path.splitext(filename)[1]
+        object_path = os.path.join(self.objects_dir, key + ext)
+        os.replace(file_path, object_path)
+
+        now = time.time()
+        size = os.path.getsize(object_path)
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, filename, path, size, created_at, last_access, meta) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, filename, object_path, size, now, now, json.dumps(meta or {}, ensure_ascii=False)))
+            if lease:
+                self._acquire(conn, key, lease, now)
+
+        # 没有租约时刚发布的条目还没有被调用方导出，本次淘汰时跳过
+        self.evict(keep=key)
+        return self.lookup(key)
+
+    def export(self, entry, output_dir, filename=None):
+        """
+        把存储中的文件交给调用方：优先创建硬链接（不占额外空间），失败时复制
+        每次导出使用唯一的文件名（加随机后缀），多个请求导出同一条目时各自持有自己的文件
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        name, ext = os.path.splitext(filename or entry['filename'])
+        target = os.path.join(output_dir, f'{name}_{uuid.uuid4().hex[:8]}{ext}')
+        try:
+            os.link(entry['path'], target)
+        except OSError:
+            shutil.copyfile(entry['path'], target)
+        return target
+
+    def evict(self, keep=None):
+        """总大小超过上限时，按最近访问时间淘汰没有有效租约的条目（keep指定的键除外），并清理过期的租约"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM leases WHERE expires_at <= ?', (time.time(),))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return []
+            rows = conn.execute(
+                'SELECT key, path, size FROM entries WHERE key NOT IN (SELECT key FROM leases) AND key != ? '
+                'ORDER BY last_access ASC',
+                (keep or '',)).fetchall()
+
+            evicted = []
+            for row in rows:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(row['path'])
+                except FileNotFoundError:
+                    pass
+                conn.execute('DELETE FROM entries WHERE key = ?', (row['key'],))
+                total -= row['size']
+                evicted.append(row['key'])
+            return evicted
+
+    def stats(self):
+        with self._connect() as conn:
+            row = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            leases = conn.execute('SELECT COUNT(*) FROM leases WHERE expires_at > ?', (time.time(),)).fetchone()[0]
+        return {'entries': row[0], 'total_bytes': row[1], 'max_bytes': self.max_bytes, 'leases': leases}
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store():
+    """获取默认存储，设置DOWNLOAD_STORE=0可禁用"""
+    global _default_store
+    if os.environ.get('DOWNLOAD_STORE', '1') == '0':
+        return None
+    with _default_store_lock:
+        if _default_store is None:
+            try:
+                _default_store = DownloadStore()
+            except (OSError, sqlite3.Error):
+                return None
+        return _default_store
+
+
+def main():
+    """命令行接口：查看统计、释放租约、手动淘汰"""
+    if len(sys.argv) < 2 or sys.argv[1] not in ('stats', 'release', 'evict'):
+        print(json.dumps({
+            'success': False,
+            'error': 'Usage: python download_store.py <stats|release <lease>|evict>'
+        }))
+        sys.exit(1)
+
+    store = DownloadStore()
+    command = sys.argv[1]
+    if command == 'stats':
+        result = {'success': True}
+        result.update(store.stats())
+    elif command == 'release':
+        if len(sys.argv) != 3:
+            print(json.dumps({'success': False, 'error': 'Usage: python download_store.py release <lease>'}))
+            sys.exit(1)
+        store.release(sys.argv[2])
+        result = {'success': True, 'lease': sys.argv[2]}
+    else:
+        result = {'success': True, 'evicted': store.evict()}
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
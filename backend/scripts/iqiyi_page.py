@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+爱奇艺视频页面
+iqiyi_parser和iqiyi_parser_simple共用：
+- 每次解析只下载一次页面，tvid/vid、标题、描述、缩略图都从同一份页面源码中提取
+- 解析器持有一个带连接池的Session，同一次解析（以及--serve模式下的多次解析）复用到爱奇艺各主机的连接
+"""
+
+import os
+import re
+import sys
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from output_format import write_result
+
+# 连接池：主机数和每个主机保持的连接数
+POOL_CONNECTIONS = int(os.environ.get('IQIYI_POOL_CONNECTIONS', 4))
+POOL_MAXSIZE = int(os.environ.get('IQIYI_POOL_MAXSIZE', 8))
+# 连接失败和5xx/429的重试次数及退避系数（秒）
+HTTP_RETRIES = int(os.environ.get('IQIYI_HTTP_RETRIES', 2))
+HTTP_BACKOFF = float(os.environ.get('IQIYI_HTTP_BACKOFF', 0.3))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+PAGE_REFERER = "https://www.iqiyi.com/"
+PAGE_TIMEOUT = 15
+
+# 以下模式都预先编译，并且都以字面量开头：CPython的re对这类模式使用快速的字面量查找，
+# 按优先级逐个搜索、找到即停，比把所有字段合成一个多分支正则扫描一遍更快
+
+# 页面中的tvid/vid，按顺序尝试，tvid和vid都找到才算成功
+PAGE_ID_PATTERNS = [
+    (re.compile(r'"tvId":"([^"]+)"'), re.compile(r'"vid":"([^"]+)"')),
+    (re.compile(r'tvid["\']?\s*[:=]\s*["\']?([A-Za-z0-9]+)'), re.compile(r'vid["\']?\s*[:=]\s*["\']?([A-Za-z0-9]+)')),
+    (re.compile(r'data-player-tvid="([^"]+)"'), re.compile(r'data-player-videoid="([^"]+)"')),
+]
+# 专辑页面：albumId作为tvid，tvId作为vid
+ALBUM_ID_PATTERNS = [
+    (re.compile(r'"albumId":([0-9]+)'), re.compile(r'"tvId":([0-9]+)')),
+]
+
+TITLE_PATTERNS = [
+    re.compile(r'<title[^>]*>([^<]+)</title>'),
+    re.compile(r'"albumName":"([^"]+)"'),
+    re.compile(r'"name":"([^"]+)"'),
+    re.compile(r'data-player-name="([^"]+)"')
+]
+# 去掉标题中的站点后缀
+TITLE_SUFFIX_PATTERN = re.compile(r'(?:[-_].*?爱奇艺.*|_高清视频在线观看.*)$')
+
+DESCRIPTION_PATTERNS = [
+    re.compile(r'"description":"([^"]+)"'),
+    re.compile(r'<meta name="description" content="([^"]+)"')
+]
+
+THUMBNAIL_PATTERNS = [
+    re.compile(r'"img":"([^"]+)"'),
+    re.compile(r'data-player-poster="([^"]+)"'),
+    re.compile(r'"albumImg":"([^"]+)"')
+]
+
+
+def _accept_encoding():
+    """requests只有在安装了brotli时才能解码br"""
+    for module in ('brotli', 'brotlicffi'):
+        try:
+            __import__(module)
+            return 'gzip, deflate, br'
+        except ImportError:
+            continue
+    return 'gzip, deflate'
+
+
+def create_session():
+    """创建带连接池、keep-alive和重试退避的Session"""
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept-Encoding': _accept_encoding(),
+        'Connection': 'keep-alive',
+    })
+    return session
+
+
+def extract_ids(text, patterns=PAGE_ID_PATTERNS):
+    """从页面源码提取 (tvid, vid)，找不到时返回 (None, None)"""
+    for tvid_pattern, vid_pattern in patterns:
+        # 没有tvid时不必再搜索vid
+        tvid_match = tvid_pattern.search(text)
+        vid_match = tvid_match and vid_pattern.search(text)
+
+        if vid_match:
+            return tvid_match.group(1), vid_match.group(1)
+    return None, None
+
+
+def extract_info(text, min_title_length=1):
+    """从页面源码提取标题、描述和缩略图，只返回找到的字段"""
+    result = {}
+
+    for pattern in TITLE_PATTERNS:
+        title_match = pattern.search(text)
+        if title_match:
+            # 清理标题
+            title = TITLE_SUFFIX_PATTERN.sub('', title_match.group(1).strip()).strip()
+            if title and title != '爱奇艺' and len(title) >= min_title_length:
+                result['title'] = title
+                break
+
+    for pattern in DESCRIPTION_PATTERNS:
+        desc_match = pattern.search(text)
+        if desc_match:
+            description = desc_match.group(1).strip()
+            if description and len(description) > 10:
+                result['description'] = description[:200] + '...' if len(description) > 200 else description
+                break
+
+    for pattern in THUMBNAIL_PATTERNS:
+        thumb_match = pattern.search(text)
+        if thumb_match:
+            thumbnail = thumb_match.group(1).strip()
+            if thumbnail.startswith('http'):
+                result['thumbnail'] = thumbnail
+                break
+
+    return result
+
+
+class IqiyiPage:
+    """
+    一次解析中的视频页面，首次访问text时下载，之后复用（下载失败也只尝试一次）
+    可以在多个线程中访问，下载进行中时其它线程等待同一次下载的结果
+    """
+
+    def __init__(self, url, headers, timeout=PAGE_TIMEOUT, session=None):
+        self.url = url
+        self.session = session or requests
+        self.headers = dict(headers)
+        self.headers["Referer"] = PAGE_REFERER
+        self.timeout = timeout
+        self.error = None
+        self._text = None
+        self._fetched = False
+        self._lock = threading.Lock()
+
+    @property
+    def text(self):
+        """页面源码，下载失败时为None（错误保存在error中）"""
+        with self._lock:
+            if not self._fetched:
+                self._fetched = True
+                try:
+                    res = self.session.get(self.url, headers=self.headers, timeout=self.timeout)
+                    res.encoding = 'utf-8'  # 确保正确的编码
+                    self._text = res.text
+                except Exception as e:
+                    self.error = e
+            return self._text
+
+    def ids(self, patterns=PAGE_ID_PATTERNS):
+        text = self.text
+        return extract_ids(text, patterns) if text is not None else (None, None)
+
+    def info(self, min_title_length=1):
+        text = self.text
+        return extract_info(text, min_title_length) if text is not None else {}
+
+
+def serve(create_parser, output_format='json', input_stream=None, output_stream=None):
+    """
+    常驻模式：每行读取一个爱奇艺链接，每个结果输出为一行
+    同一个解析器（及其Session）处理所有请求，连接在多次解析间复用
+    """
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+
+    # 结果独占stdout，解析器的提示信息重定向到stderr
+    sys.stdout = sys.stderr
+    parser = create_parser()
+
+    for line in input_stream:
+        url = line.strip()
+        if not url:
+            continue
+
+        if 'iqiyi.com' not in url:
+            result = {
+                'success': False,
+                'error': '不是有效的爱奇艺链接',
+                'error_type': 'invalid_url'
+            }
+        else:
+            result = parser.parse_video(url)
+        result.setdefault('url', url)
+        write_result(result, output_format, output_stream, line=True)
@@ -4,8 +4,6 @@
 基于原始爱奇艺解析代码，适配到我们的视频下载器项目
 """
 
-import requests
-import execjs
 import re
 import time
 import json
@@ -14,6 +12,16 @@ import traceback
 from urllib.parse import quote, unquote
 import hashlib
 import os
+import queue
+import threading
+
+from iqiyi_page import IqiyiPage, create_session, serve
+from iqiyi_signer import SignerError, get_signer
+from output_format import OutputFormatError, pop_format_arg, write_result
+from thumbnail_cache import add_local_thumbnails
+
+# 获取tvid/vid的方式：race（加速器接口和页面并发请求）或sequential（先加速器后页面）
+ID_LOOKUP_MODE = os.environ.get('IQIYI_ID_LOOKUP', 'race')
 
 
 class IqiyiParser:
@@ -21,36 +29,17 @@ class IqiyiParser:
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 11_2_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.90 Safari/537.36"
         }
+        # 所有请求共用的连接池
+        self.session = create_session()
 
-        # 尝试加载JS文件（可选）
-        self.authkey = None
-        self.cmd5js = None
+        # 签名引擎（IQIYI_SIGNER选择native/persistent/execjs），不可用时只返回基本信息
+        self.signer = None
 
         try:
-            self.authkey = self.load_auth_js()
-            self.cmd5js = self.load_cmd5x_js()
-            if self.authkey and self.cmd5js:
-                print("✅ JS认证文件加载成功，启用完整解析功能")
-            else:
-                print("⚠️ JS文件加载失败，使用简化解析模式")
-        except Exception as e:
-            print(f"⚠️ JS文件加载失败: {e}，使用简化解析模式")
-
-    def load_auth_js(self):
-        """加载认证JS文件"""
-        js_path = os.path.join(os.path.dirname(__file__), 'js', 'iqiyi.js')
-        if os.path.exists(js_path):
-            with open(js_path, 'r', encoding='utf-8') as f:
-                return execjs.compile(f.read())
-        return None
-
-    def load_cmd5x_js(self):
-        """加载MD5 JS文件"""
-        js_path = os.path.join(os.path.dirname(__file__), 'js', 'cmd5x.js')
-        if os.path.exists(js_path):
-            with open(js_path, 'r', encoding='utf-8') as f:
-                return execjs.compile(f.read())
-        return None
+            self.signer = get_signer()
+            print(f"✅ 签名引擎({self.signer.name})加载成功，启用完整解析功能")
+        except SignerError as e:
+            print(f"⚠️ 签名引擎加载失败: {e}，使用简化解析模式")
 
     def extract_video_id(self, url):
         """从URL中提取视频ID"""
@@ -69,61 +58,72 @@ class IqiyiParser:
         except:
             return None
 
-    def get_tvid_vid(self, url):
-        """获取tvid和vid"""
+    def get_tvid_vid(self, url, page=None):
+        """
+        获取tvid和vid（page为本次解析的IqiyiPage，页面只下载一次）
+        默认同时请求加速器接口和页面，先得到完整ID的一方胜出；
+        IQIYI_ID_LOOKUP=sequential时先请求加速器，失败后再从页面获取
+        """
+        page = page or IqiyiPage(url, self.headers, session=self.session)
+        if ID_LOOKUP_MODE == 'sequential':
+            tvid, vid = self.get_tvid_from_accelerator(url)
+            if tvid and vid:
+                return tvid, vid
+            # 如果失败，从页面获取
+            return self.get_tvid_from_page(url, page)
+
+        results = queue.Queue()
+
+        def lookup(source):
+            try:
+                results.put(source())
+            except Exception:
+                results.put((None, None))
+
+        # 守护线程：胜出后不再等待另一方（页面仍会下载完，供提取页面信息使用）
+        for source in (lambda: self.get_tvid_from_accelerator(url), lambda: self.get_tvid_from_page(url, page)):
+            threading.Thread(target=lookup, args=(source,), daemon=True).start()
+
+        for _ in range(2):
+            tvid, vid = results.get()
+            if tvid and vid:
+                return tvid, vid
+        return None, None
+
+    def get_tvid_from_accelerator(self, url):
+        """从加速器接口获取tvid和vid"""
         try:
-            # 尝试从加速器接口获取
             accelerator = "https://mesh.if.iqiyi.com/player/lw/lwplay/accelerator.js"
             headers = self.headers.copy()
             headers["Referer"] = url.split("?")[0]
 
-            res = requests.get(accelerator, headers=headers, timeout=10)
+            res = self.session.get(accelerator, headers=headers, timeout=10)
 
             tvid_match = re.search(r'"tvid":([A-Za-z0-9]+)', res.text)
             vid_match = re.search(r'"vid":"([A-Za-z0-9]+)"', res.text)
 
             if tvid_match and vid_match:
                 return tvid_match.group(1), vid_match.group(1)
-
-            # 如果失败，尝试从页面获取
-            return self.get_tvid_from_page(url)
+            return None, None
 
         except Exception as e:
-            # 备用方案：从页面获取
-            return self.get_tvid_from_page(url)
+            return None, None
 
-    def get_tvid_from_page(self, url):
+    def get_tvid_from_page(self, url, page=None):
         """从页面源码获取tvid和vid"""
         try:
-            headers = self.headers.copy()
-            headers["Referer"] = "https://www.iqiyi.com/"
-
-            res = requests.get(url, headers=headers, timeout=15)
-
-            # 尝试多种正则表达式
-            patterns = [
-                (r'"tvId":"([^"]+)"', r'"vid":"([^"]+)"'),
-                (r'tvid["\']?\s*[:=]\s*["\']?([A-Za-z0-9]+)', r'vid["\']?\s*[:=]\s*["\']?([A-Za-z0-9]+)'),
-                (r'data-player-tvid="([^"]+)"', r'data-player-videoid="([^"]+)"'),
-            ]
-
-            for tvid_pattern, vid_pattern in patterns:
-                tvid_match = re.search(tvid_pattern, res.text)
-                vid_match = re.search(vid_pattern, res.text)
-
-                if tvid_match and vid_match:
-                    return tvid_match.group(1), vid_match.group(1)
-
-            return None, None
-
+            return (page or IqiyiPage(url, self.headers, session=self.session)).ids()
         except:
             return None, None
 
     def parse_video(self, url):
         """解析爱奇艺视频"""
         try:
+            # 本次解析共用的页面，取ID和页面信息时只下载一次
+            page = IqiyiPage(url, self.headers, session=self.session)
+
             # 获取tvid和vid
-            tvid, vid = self.get_tvid_vid(url)
+            tvid, vid = self.get_tvid_vid(url, page)
 
             if not tvid or not vid:
                 return {
@@ -148,14 +148,17 @@ class IqiyiParser:
 
             # 尝试获取更多信息
             try:
-                page_info = self.get_page_info(url)
+                page_info = self.get_page_info(url, page)
                 if page_info:
                     video_info.update(page_info)
             except:
                 pass  # 如果获取失败，返回基本信息
 
-            # 如果有JS认证文件，尝试获取视频流信息
-            if self.authkey and self.cmd5js:
+            # 缩略图换成本地代理地址
+            add_local_thumbnails([video_info], 'thumbnail')
+
+            # 如果有签名引擎，尝试获取视频流信息
+            if self.signer:
                 try:
                     stream_info = self.get_stream_info(url, tvid, vid)
                     if stream_info:
@@ -174,72 +177,15 @@ class IqiyiParser:
                 'details': traceback.format_exc()
             }
 
-    def get_page_info(self, url):
+    def get_page_info(self, url, page=None):
         """从页面获取更多视频信息"""
         try:
-            headers = self.headers.copy()
-            headers["Referer"] = "https://www.iqiyi.com/"
-
-            res = requests.get(url, headers=headers, timeout=15)
-            res.encoding = 'utf-8'  # 确保正确的编码
-
-            result = {}
-
-            # 尝试提取标题
-            title_patterns = [
-                r'<title[^>]*>([^<]+)</title>',
-                r'"albumName":"([^"]+)"',
-                r'"name":"([^"]+)"',
-                r'data-player-name="([^"]+)"'
-            ]
-
-            for pattern in title_patterns:
-                title_match = re.search(pattern, res.text)
-                if title_match:
-                    title = title_match.group(1).strip()
-                    # 清理标题
-                    title = re.sub(r'[-_].*?爱奇艺.*$', '', title).strip()
-                    title = re.sub(r'_高清视频在线观看.*$', '', title).strip()
-                    if title and title != '爱奇艺':
-                        result['title'] = title
-                        break
-
-            # 尝试提取描述
-            desc_patterns = [
-                r'"description":"([^"]+)"',
-                r'<meta name="description" content="([^"]+)"'
-            ]
-
-            for pattern in desc_patterns:
-                desc_match = re.search(pattern, res.text)
-                if desc_match:
-                    description = desc_match.group(1).strip()
-                    if description and len(description) > 10:
-                        result['description'] = description[:200] + '...' if len(description) > 200 else description
-                        break
-
-            # 尝试提取缩略图
-            thumb_patterns = [
-                r'"img":"([^"]+)"',
-                r'data-player-poster="([^"]+)"',
-                r'"albumImg":"([^"]+)"'
-            ]
-
-            for pattern in thumb_patterns:
-                thumb_match = re.search(pattern, res.text)
-                if thumb_match:
-                    thumbnail = thumb_match.group(1).strip()
-                    if thumbnail.startswith('http'):
-                        result['thumbnail'] = thumbnail
-                        break
-
-            return result
-
+            return (page or IqiyiPage(url, self.headers, session=self.session)).info()
         except Exception as e:
             return {}
 
     def get_stream_info(self, url, tvid, vid):
-        """获取视频流信息（使用JS认证）"""
+        """获取视频流信息（使用签名引擎生成authKey和vf）"""
         try:
             _time = int(time.time() * 1000)
 
@@ -284,27 +230,27 @@ class IqiyiParser:
                 "ut": "0"
             }
 
-            # 使用JS生成认证密钥
-            auth_base = self.authkey.call("auth", "")
+            # 生成认证密钥
+            auth_base = self.signer.auth("")
             auth_string = f"{auth_base}{_time}{tvid}"
-            params["authKey"] = self.authkey.call("auth", auth_string)
+            params["authKey"] = self.signer.auth(auth_string)
 
             # 构建URL参数字符串
             temp = "/dash?"
             for k, v in params.items():
                 temp += k + "=" + str(v) + "&"
 
-            # 使用JS生成验证字符串
-            vf_str = self.authkey.call("addChar", temp[:-1])
+            # 生成验证字符串
+            vf_str = self.signer.add_char(temp[:-1])
             vf = hashlib.md5(vf_str.encode("utf-8")).hexdigest()
             params['vf'] = vf
             params["bop"] = unquote(params["bop"])
 
             # 调用爱奇艺API
-            response = requests.get("https://cache.video.iqiyi.com/dash",
-                                  params=params,
-                                  headers=self.headers,
-                                  timeout=15)
+            response = self.session.get("https://cache.video.iqiyi.com/dash",
+                                      params=params,
+                                      headers=self.headers,
+                                      timeout=15)
 
             if response.status_code == 200:
                 data = response.json()
@@ -352,14 +298,29 @@ def main():
     import io
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-    if len(sys.argv) != 2:
+    try:
+        output_format, args = pop_format_arg(sys.argv[1:])
+    except OutputFormatError as e:
+        print(json.dumps({
+            'success': False,
+            'error': str(e),
+            'error_type': 'invalid_format'
+        }, ensure_ascii=False))
+        sys.exit(1)
+
+    if args == ['--serve']:
+        # 常驻模式：从stdin逐行读取链接，复用同一个解析器的连接
+        serve(IqiyiParser, output_format)
+        return
+
+    if len(args) != 1:
         print(json.dumps({
             'success': False,
-            'error': 'Usage: python iqiyi_parser.py <iqiyi_url>'
+            'error': 'Usage: python iqiyi_parser.py [--format=json|compact-json|ndjson|msgpack] <iqiyi_url|--serve>'
         }, ensure_ascii=False))
         sys.exit(1)
 
-    url = sys.argv[1]
+    url = args[0]
 
     # 验证是否为爱奇艺链接
     if 'iqiyi.com' not in url:
@@ -374,8 +335,7 @@ def main():
     result = parser.parse_video(url)
 
     # 确保中文字符正确输出
-    output = json.dumps(result, ensure_ascii=False, indent=2)
-    print(output)
+    write_result(result, output_format)
 
 
 if __name__ == '__main__':
@@ -4,7 +4,6 @@
 支持execjs但不依赖复杂的认证逻辑
 """
 
-import requests
 import re
 import time
 import json
@@ -13,6 +12,8 @@ import traceback
 import os
 import io
 
+from iqiyi_page import ALBUM_ID_PATTERNS, PAGE_ID_PATTERNS, IqiyiPage, create_session, serve
+
 # 设置输出编码
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
@@ -21,6 +22,8 @@ class IqiyiParserSimple:
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         }
+        # 所有请求共用的连接池
+        self.session = create_session()
         
         # 检查是否支持execjs
         self.has_execjs = False
@@ -48,29 +51,17 @@ class IqiyiParserSimple:
         except:
             return None
 
-    def get_tvid_vid_from_page(self, url):
-        """从页面源码获取tvid和vid"""
+    def get_tvid_vid_from_page(self, url, page=None):
+        """从页面源码获取tvid和vid（page为本次解析的IqiyiPage，页面只下载一次）"""
         try:
-            headers = self.headers.copy()
-            headers["Referer"] = "https://www.iqiyi.com/"
-            
-            res = requests.get(url, headers=headers, timeout=15)
-            res.encoding = 'utf-8'
-            
+            page = page or IqiyiPage(url, self.headers, session=self.session)
+            if page.text is None:
+                raise page.error
+
             # 尝试多种正则表达式
-            patterns = [
-                (r'"tvId":"([^"]+)"', r'"vid":"([^"]+)"'),
-                (r'tvid["\']?\s*[:=]\s*["\']?([A-Za-z0-9]+)', r'vid["\']?\s*[:=]\s*["\']?([A-Za-z0-9]+)'),
-                (r'data-player-tvid="([^"]+)"', r'data-player-videoid="([^"]+)"'),
-                (r'"albumId":([0-9]+)', r'"tvId":([0-9]+)'),
-            ]
-            
-            for tvid_pattern, vid_pattern in patterns:
-                tvid_match = re.search(tvid_pattern, res.text)
-                vid_match = re.search(vid_pattern, res.text)
-                
-                if tvid_match and vid_match:
-                    return tvid_match.group(1), vid_match.group(1)
+            tvid, vid = page.ids(PAGE_ID_PATTERNS + ALBUM_ID_PATTERNS)
+            if tvid and vid:
+                return tvid, vid
             
             # 如果都失败了，尝试从URL提取
             vid_from_url = self.extract_video_id(url)
@@ -83,66 +74,13 @@ class IqiyiParserSimple:
             print(f"从页面获取ID失败: {e}")
             return None, None
 
-    def get_page_info(self, url):
+    def get_page_info(self, url, page=None):
         """从页面获取视频信息"""
         try:
-            headers = self.headers.copy()
-            headers["Referer"] = "https://www.iqiyi.com/"
-            
-            res = requests.get(url, headers=headers, timeout=15)
-            res.encoding = 'utf-8'
-            
-            result = {}
-            
-            # 提取标题
-            title_patterns = [
-                r'<title[^>]*>([^<]+)</title>',
-                r'"albumName":"([^"]+)"',
-                r'"name":"([^"]+)"',
-                r'data-player-name="([^"]+)"'
-            ]
-            
-            for pattern in title_patterns:
-                title_match = re.search(pattern, res.text)
-                if title_match:
-                    title = title_match.group(1).strip()
-                    # 清理标题
-                    title = re.sub(r'[-_].*?爱奇艺.*$', '', title).strip()
-                    title = re.sub(r'_高清视频在线观看.*$', '', title).strip()
-                    if title and title != '爱奇艺' and len(title) > 2:
-                        result['title'] = title
-                        break
-            
-            # 提取描述
-            desc_patterns = [
-                r'"description":"([^"]+)"',
-                r'<meta name="description" content="([^"]+)"'
-            ]
-            
-            for pattern in desc_patterns:
-                desc_match = re.search(pattern, res.text)
-                if desc_match:
-                    description = desc_match.group(1).strip()
-                    if description and len(description) > 10:
-                        result['description'] = description[:200] + '...' if len(description) > 200 else description
-                        break
-            
-            # 提取缩略图
-            thumb_patterns = [
-                r'"img":"([^"]+)"',
-                r'data-player-poster="([^"]+)"',
-                r'"albumImg":"([^"]+)"'
-            ]
-            
-            for pattern in thumb_patterns:
-                thumb_match = re.search(pattern, res.text)
-                if thumb_match:
-                    thumbnail = thumb_match.group(1).strip()
-                    if thumbnail.startswith('http'):
-                        result['thumbnail'] = thumbnail
-                        break
-            
-            return result
+            page = page or IqiyiPage(url, self.headers, session=self.session)
+            if page.text is None:
+                raise page.error
+            return page.info(min_title_length=3)
             
         except Exception as e:
             print(f"获取页面信息失败: {e}")
@@ -151,8 +89,11 @@ class IqiyiParserSimple:
     def parse_video(self, url):
         """解析爱奇艺视频"""
         try:
+            # 本次解析共用的页面，取ID和页面信息时只下载一次
+            page = IqiyiPage(url, self.headers, session=self.session)
+
             # 获取tvid和vid
-            tvid, vid = self.get_tvid_vid_from_page(url)
+            tvid, vid = self.get_tvid_vid_from_page(url, page)
             
             if not tvid or not vid:
                 return {
@@ -181,7 +122,7 @@ class IqiyiParserSimple:
 
             # 获取页面信息
             try:
-                page_info = self.get_page_info(url)
+                page_info = self.get_page_info(url, page)
                 if page_info:
                     video_info.update(page_info)
             except:
@@ -203,9 +144,14 @@ def main():
     if len(sys.argv) != 2:
         print(json.dumps({
             'success': False,
-            'error': 'Usage: python iqiyi_parser_simple.py <iqiyi_url>'
+            'error': 'Usage: python iqiyi_parser_simple.py <iqiyi_url|--serve>'
         }, ensure_ascii=False))
         sys.exit(1)
+
+    if sys.argv[1] == '--serve':
+        # 常驻模式：从stdin逐行读取链接，复用同一个解析器的连接
+        serve(IqiyiParserSimple)
+        return
     
     url = sys.argv[1]
     
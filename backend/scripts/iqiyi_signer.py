@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+爱奇艺请求签名（js/iqiyi.js中的auth/addChar）
+通过IQIYI_SIGNER选择实现：
+- native      Python移植版（默认），不启动任何外部进程
+- persistent  常驻的node进程，通过管道调用js/iqiyi.js，整个解析器生命周期只启动一次
+- execjs      原有的PyExecJS方式，每次调用都可能启动一次外部JS运行时
+python iqiyi_signer.py verify [native|persistent] 用一组固定输入与JS原版逐一比对
+"""
+
+import atexit
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+JS_DIR = os.path.join(os.path.dirname(__file__), 'js')
+AUTH_JS_PATH = os.path.join(JS_DIR, 'iqiyi.js')
+SIGNER_SERVER_PATH = os.path.join(JS_DIR, 'signer_server.js')
+
+SIGNER_KINDS = ('native', 'persistent', 'execjs')
+DEFAULT_SIGNER = os.environ.get('IQIYI_SIGNER', 'native')
+
+# 与js/iqiyi.js保持一致
+AUTH_BASE_KEY = "cb2c7d269b5b8c8e8b8e8b8e8b8e8b8e"
+AUTH_XOR = 0x5A
+
+
+class SignerError(Exception):
+    """签名引擎不可用或调用失败"""
+
+
+class NativeSigner:
+    """auth/addChar的Python实现"""
+
+    name = 'native'
+
+    def auth(self, key):
+        if not key:
+            return AUTH_BASE_KEY
+        # JS按UTF-16码元异或，非BMP字符拆成代理对后逐个处理
+        units = key.encode('utf-16-le', 'surrogatepass')
+        xored = bytearray(units)
+        for i in range(0, len(xored), 2):
+            xored[i] ^= AUTH_XOR
+        return xored.decode('utf-16-le', 'surrogatepass')
+
+    def add_char(self, value, now=None):
+        """now为毫秒时间戳，默认使用当前时间"""
+        if not value:
+            return ""
+        timestamp = math.floor((time.time() * 1000 if now is None else now) / 1000)
+        return f"{value}&t={timestamp}&k={AUTH_BASE_KEY}"
+
+    def close(self):
+        pass
+
+
+class PersistentJsSigner:
+    """常驻node进程中的JS实现，通过stdin/stdout逐行通信"""
+
+    name = 'persistent'
+
+    def __init__(self, js_path=AUTH_JS_PATH, node=None):
+        self.js_path = js_path
+        self.node = node or shutil.which('node')
+        if not self.node:
+            raise SignerError('node is not installed')
+        if not os.path.exists(js_path):
+            raise SignerError(f'Signing script not found: {js_path}')
+        self._process = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            [self.node, SIGNER_SERVER_PATH, self.js_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, encoding='utf-8', bufsize=1)
+
+    def call(self, fn, *args, now=None):
+        request = json.dumps({'fn': fn, 'args': list(args), 'now': now}, ensure_ascii=False)
+        with self._lock:
+            # 进程意外退出时重启一次
+            for attempt in range(2):
+                if self._process is None or self._process.poll() is not None:
+                    self._start()
+                try:
+                    self._process.stdin.write(request + '\n')
+                    self._process.stdin.flush()
+                    line = self._process.stdout.readline()
+                except (BrokenPipeError, OSError):
+                    line = ''
+                if line:
+                    break
+                self._process = None
+            else:
+                raise SignerError('Signing process exited unexpectedly')
+
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise SignerError(reply['error'])
+        return reply['result']
+
+    def auth(self, key):
+        return self.call('auth', key)
+
+    def add_char(self, value, now=None):
+        return self.call('addChar', value, now=now)
+
+    def close(self):
+        process, self._process = self._process, None
+        if process and process.poll() is None:
+            process.stdin.close()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+class ExecjsSigner:
+    """PyExecJS编译的JS实现（原有方式）"""
+
+    name = 'execjs'
+
+    def __init__(self, js_path=AUTH_JS_PATH):
+        try:
+            import execjs
+        except ImportError:
+            raise SignerError('execjs signer requires PyExecJS: pip install PyExecJS')
+        if not os.path.exists(js_path):
+            raise SignerError(f'Signing script not found: {js_path}')
+        with open(js_path, 'r', encoding='utf-8') as f:
+            self._context = execjs.compile(f.read())
+
+    def auth(self, key):
+        return self._context.call("auth", key)
+
+    def add_char(self, value, now=None):
+        if now is not None:
+            raise SignerError('execjs signer does not support a fixed timestamp')
+        return self._context.call("addChar", value)
+
+    def close(self):
+        pass
+
+
+def get_signer(kind=None):
+    """按名称（默认IQIYI_SIGNER）创建签名引擎，不可用时抛出SignerError"""
+    kind = kind or DEFAULT_SIGNER
+    if kind == 'native':
+        return NativeSigner()
+    if kind == 'persistent':
+        return PersistentJsSigner()
+    if kind == 'execjs':
+        return ExecjsSigner()
+    raise SignerError(f'Unknown signer: {kind}. Available signers: {", ".join(SIGNER_KINDS)}')
+
+
+# 比对用的固定输入：空串、ASCII、实际请求中的authKey原文和dash参数串、中文及非BMP字符
+GOLDEN_AUTH_INPUTS = [
+    "",
+    "a",
+    "Z",
+    AUTH_BASE_KEY,
+    f"{AUTH_BASE_KEY}1700000000000123456789",
+    f"{AUTH_BASE_KEY}1712345678901abcdefABCDEF0123",
+    "爱奇艺",
+    "emoji 😀 test",
+    "~!@#$%^&*()_+{}|:\"<>?`-=[]\\;',./",
+]
+GOLDEN_ADD_CHAR_INPUTS = [
+    ("", 1700000000000),
+    ("/dash?tvid=123&bid=300&vid=abc", 1700000000000),
+    ("/dash?tvid=123&bid=300&vid=abc", 1700000000999),
+    ("/dash?tm=1712345678901&bop=%7B%22version%22%3A%2210.0%22%7D&ut=0", 1712345678901),
+    ("爱奇艺", 0),
+]
+
+
+def verify(signer, reference):
+    """用固定输入比对两个签名引擎，返回不一致的条目列表"""
+    mismatches = []
+    for key in GOLDEN_AUTH_INPUTS:
+        expected, actual = reference.auth(key), signer.auth(key)
+        if expected != actual:
+            mismatches.append({'fn': 'auth', 'input': key, 'expected': expected, 'actual': actual})
+    for value, now in GOLDEN_ADD_CHAR_INPUTS:
+        expected, actual = reference.add_char(value, now), signer.add_char(value, now)
+        if expected != actual:
+            mismatches.append({'fn': 'addChar', 'input': value, 'now': now, 'expected': expected, 'actual': actual})
+    return mismatches
+
+
+def main():
+    """命令行接口：与JS原版（常驻node进程）比对签名结果"""
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != 'verify' or \
+            (len(sys.argv) == 3 and sys.argv[2] not in ('native', 'persistent')):
+        print(json.dumps({
+            'success': False,
+            'error': 'Usage: python iqiyi_signer.py verify [native|persistent]'
+        }))
+        sys.exit(1)
+
+    kind = sys.argv[2] if len(sys.argv) == 3 else 'native'
+    try:
+        signer = get_signer(kind)
+        reference = PersistentJsSigner()
+        mismatches = verify(signer, reference)
+    except SignerError as e:
+        print(json.dumps({'success': False, 'error': str(e), 'error_type': 'signer_unavailable'}))
+        sys.exit(1)
+
+    print(json.dumps({
+        'success': not mismatches,
+        'signer': kind,
+        'cases': len(GOLDEN_AUTH_INPUTS) + len(GOLDEN_ADD_CHAR_INPUTS),
+        'mismatches': mismatches,
+    }, ensure_ascii=False, indent=2))
+    sys.exit(0 if not mismatches else 1)
+
+
+if __name__ == '__main__':
+    main()
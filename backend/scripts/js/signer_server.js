@@ -0,0 +1,33 @@
+// 常驻的签名进程：加载签名JS后逐行读取请求并逐行返回结果，供iqiyi_signer.py复用同一个node进程
+// 请求：{"fn": "auth", "args": ["..."], "now": 可选的毫秒时间戳}
+// 响应：{"result": ...} 或 {"error": "..."}
+
+const fs = require('fs');
+const readline = require('readline');
+const vm = require('vm');
+
+const context = vm.createContext({});
+vm.runInContext(fs.readFileSync(process.argv[2], 'utf8'), context, { filename: process.argv[2] });
+
+const ContextDate = vm.runInContext('Date', context);
+const realNow = ContextDate.now;
+
+readline.createInterface({ input: process.stdin }).on('line', (line) => {
+  let reply;
+  try {
+    const { fn, args, now } = JSON.parse(line);
+    if (typeof context[fn] !== 'function') {
+      throw new Error(`Unknown function: ${fn}`);
+    }
+    // 指定时间戳时固定Date.now，便于与Python实现逐字节比对
+    ContextDate.now = now == null ? realNow : () => now;
+    try {
+      reply = { result: context[fn](...(args || [])) };
+    } finally {
+      ContextDate.now = realNow;
+    }
+  } catch (error) {
+    reply = { error: String(error && error.message || error) };
+  }
+  process.stdout.write(JSON.stringify(reply) + '\n');
+});
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+命令行脚本的输出格式
+--format=json（默认，缩进的JSON，与原有输出一致）
+--format=compact-json  单行JSON，streams中的分类列表改为引用streams.all（或available）的下标
+--format=ndjson        与compact-json相同，每条记录一行（适合进度、批量结果等多条输出）
+--format=msgpack       与compact-json结构相同的MessagePack二进制
+msgpack是可选依赖（pip install msgpack），只在选择msgpack格式时才导入，未安装时其它格式不受影响
+"""
+
+import json
+import sys
+
+OUTPUT_FORMATS = ('json', 'compact-json', 'ndjson', 'msgpack')
+DEFAULT_OUTPUT_FORMAT = 'json'
+
+# streams中保存完整条目的列表，其余列表改为下标
+BASE_STREAM_LISTS = ('all', 'available')
+
+
+class OutputFormatError(ValueError):
+    """输出格式参数无效或依赖缺失"""
+
+
+def pop_format_arg(argv):
+    """
+    从参数列表中取出--format=X或--format X
+    返回 (输出格式, 其余参数)，格式无效时抛出OutputFormatError
+    """
+    output_format = DEFAULT_OUTPUT_FORMAT
+    args = []
+    iterator = iter(argv)
+    for arg in iterator:
+        if arg.startswith('--format='):
+            output_format = arg.split('=', 1)[1]
+        elif arg == '--format':
+            output_format = next(iterator, '')
+        else:
+            args.append(arg)
+
+    if output_format not in OUTPUT_FORMATS:
+        raise OutputFormatError(
+            f'Unknown output format: {output_format}. Available formats: {", ".join(OUTPUT_FORMATS)}')
+    if output_format == 'msgpack':
+        try:
+            import msgpack  # noqa: F401
+        except ImportError:
+            raise OutputFormatError('msgpack output requires the msgpack package: pip install msgpack')
+    return output_format, args
+
+
+def _index_stream_lists(streams):
+    """把分类列表中的条目替换为基础列表中的下标，找不到的条目保留原样"""
+    base_key = next((key for key in BASE_STREAM_LISTS if isinstance(streams.get(key), list)), None)
+    if base_key is None:
+        return streams
+
+    base = streams[base_key]
+    # 同一进程内的结果按对象身份匹配；从缓存读出的结果已是副本，按itag或地址匹配
+    by_identity = {id(entry): index for index, entry in enumerate(base)}
+    by_key = {}
+    for index, entry in enumerate(base):
+        if isinstance(entry, dict):
+            key = entry.get('itag') or entry.get('url')
+            if key is not None:
+                by_key.setdefault(key, index)
+
+    def index_of(entry):
+        index = by_identity.get(id(entry))
+        if index is None and isinstance(entry, dict):
+            index = by_key.get(entry.get('itag') or entry.get('url'))
+        return entry if index is None else index
+
+    indexed = {base_key: base}
+    for key, value in streams.items():
+        if key != base_key:
+            indexed[key] = [index_of(entry) for entry in value] if isinstance(value, list) else value
+    return indexed
+
+
+def index_streams(result):
+    """返回streams分类改为下标引用的结果（不修改原结果），批量结果中的result字段同样处理"""
+    if not isinstance(result, dict):
+        return result
+
+    compacted = result
+    if isinstance(result.get('streams'), dict):
+        compacted = dict(result)
+        compacted['streams'] = _index_stream_lists(result['streams'])
+        compacted['streams_indexed'] = True
+    if isinstance(result.get('result'), dict):
+        compacted = dict(compacted)
+        compacted['result'] = index_streams(result['result'])
+    return compacted
+
+
+def encode(result, output_format=DEFAULT_OUTPUT_FORMAT, line=False):
+    """
+    按输出格式编码一条记录，返回bytes
+    line为True时用于逐行输出的记录（进度、批量条目），默认格式下也输出为单行JSON
+    """
+    if output_format == 'json':
+        if line:
+            return (json.dumps(result, ensure_ascii=False) + '\n').encode('utf-8')
+        return (json.dumps(result, ensure_ascii=False, indent=2) + '\n').encode('utf-8')
+
+    result = index_streams(result)
+    if output_format == 'msgpack':
+        import msgpack
+        return msgpack.packb(result, use_bin_type=True)
+    return (json.dumps(result, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def write_result(result, output_format=DEFAULT_OUTPUT_FORMAT, stream=None, line=False):
+    """把一条记录写到stdout（或指定的流）并立即刷新"""
+    stream = stream or sys.stdout
+    data = encode(result, output_format, line)
+    buffer = getattr(stream, 'buffer', None)
+    if buffer is None:
+        stream.write(data.decode('utf-8'))
+        stream.flush()
+        return
+    # 先刷新文本层，保证与之前print的内容顺序一致
+    stream.flush()
+    buffer.write(data)
+    buffer.flush()
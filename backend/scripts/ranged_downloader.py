@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+多连接分段下载器
+把一个流按字节范围切分，用多个并发连接下载后写入预分配文件的对应偏移，最后校验总大小
+已完成的范围记录在部分文件旁的日志（.journal）中，进程中断后重试可以从断点继续
+供yewtube_service和youtube_downloader共用
+"""
+
+import json
+import os
+import queue
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+
+DEFAULT_CONNECTIONS = int(os.environ.get('DOWNLOAD_CONNECTIONS', 4))
+# 每个Range请求的大小，YouTube对单个大请求会限速，按块请求可以避免
+DEFAULT_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+RANGE_RETRIES = 3
+READ_BUFFER_SIZE = 256 * 1024
+REQUEST_TIMEOUT = 30
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+_CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+# 签名地址过期时服务器返回的状态码
+URL_EXPIRED_STATUS = (403, 410)
+
+
+class RangedDownloadError(Exception):
+    """分段下载失败"""
+
+
+class SizeMismatchError(RangedDownloadError):
+    """服务器报告的文件总大小与预期不一致，重试无意义"""
+
+
+class UrlExpiredError(RangedDownloadError):
+    """流地址已过期且重新解析失败，重试无意义"""
+
+
+class RangeJournal:
+    """记录已完成字节范围的日志文件，与部分文件放在一起"""
+
+    def __init__(self, dest_path, total_size, chunk_size):
+        self.path = dest_path + '.journal'
+        self.total_size = total_size
+        self.chunk_size = chunk_size
+        self.completed = set()
+        self.lock = threading.Lock()
+
+    def load(self, dest_path):
+        """读取日志，文件大小或分块方式不一致时视为无效"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if (data.get('total_size') != self.total_size
+                or data.get('chunk_size') != self.chunk_size
+                or not os.path.exists(dest_path)
+                or os.path.getsize(dest_path) != self.total_size):
+            return False
+
+        self.completed = {tuple(r) for r in data.get('completed', [])}
+        return True
+
+    def completed_bytes(self):
+        return sum(end - start + 1 for start, end in self.completed)
+
+    def mark_done(self, byte_range):
+        """记录一个完成的范围（先写临时文件再替换，避免日志损坏）"""
+        with self.lock:
+            self.completed.add(byte_range)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'total_size': self.total_size,
+                    'chunk_size': self.chunk_size,
+                    'completed': sorted(self.completed)
+                }, f)
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class _UrlHolder:
+    """在多个连接间共享流地址，地址过期时只重新解析一次，解析失败也只尝试一次"""
+
+    def __init__(self, url, resolve_url=None):
+        self.url = url
+        self.resolve_url = resolve_url
+        self.failed_url = None
+        self.lock = threading.Lock()
+
+    def refresh(self, expired_url):
+        if not self.resolve_url:
+            return False
+        with self.lock:
+            # 其它连接已经刷新过
+            if self.url != expired_url:
+                return True
+            # 这个地址已经重新解析失败过，不再重复解析
+            if self.failed_url == expired_url:
+                return False
+            try:
+                new_url = self.resolve_url()
+            except Exception:
+                new_url = None
+            if not new_url:
+                self.failed_url = expired_url
+                return False
+            self.url = new_url
+            return True
+
+
+def _open(url, headers, byte_range=None):
+    request_headers = dict(DEFAULT_HEADERS)
+    request_headers.update(headers or {})
+    if byte_range:
+        request_headers['Range'] = f'bytes={byte_range[0]}-{byte_range[1]}'
+    return urllib.request.urlopen(urllib.request.Request(url, headers=request_headers), timeout=REQUEST_TIMEOUT)
+
+
+def probe_size(url, headers=None):
+    """用bytes=0-0请求探测文件总大小，服务器不支持Range时返回None"""
+    with _open(url, headers, (0, 0)) as response:
+        if response.status != 206:
+            return None
+        match = _CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+        return int(match.group(3)) if match and match.group(3) != '*' else None
+
+
+def check_range_response(response, start, end, total_size):
+    """
+    校验206响应的Content-Range：返回的范围必须与请求的一致，总大小必须等于total_size
+    （调用方传入的预期大小可能有误，每个分段都与服务器报告的总大小核对）
+    """
+    if response.status != 206:
+        raise RangedDownloadError(f'Server ignored range request (HTTP {response.status})')
+    content_range = response.headers.get('Content-Range', '')
+    match = _CONTENT_RANGE_PATTERN.match(content_range)
+    if not match:
+        raise RangedDownloadError(f'Missing or invalid Content-Range: {content_range!r}')
+    if match.group(3) != '*' and int(match.group(3)) != total_size:
+        raise SizeMismatchError(
+            f'Size mismatch: expected {total_size} bytes, server reports {match.group(3)}')
+    if int(match.group(1)) != start or int(match.group(2)) != end:
+        raise RangedDownloadError(
+            f'Server returned range {match.group(1)}-{match.group(2)}, requested {start}-{end}')
+
+
+def split_ranges(total_size, chunk_size=DEFAULT_CHUNK_SIZE):
+    """按块大小切分字节范围（闭区间）"""
+    return [(start, min(start + chunk_size, total_size) - 1) for start in range(0, total_size, chunk_size)]
+
+
+class ProgressCounter:
+    """汇总多个连接的下载进度"""
+
+    def __init__(self, total_size, callback, downloaded=0, interval=0.5):
+        self.total_size = total_size
+        self.callback = callback
+        self.downloaded = downloaded
+        self.initial = downloaded
+        self.interval = interval
+        self.start_time = time.time()
+        self.last_update = 0
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        with self.lock:
+            self.downloaded += size
+            now = time.time()
+            if not self.callback or now - self.last_update < self.interval:
+                return
+            self.last_update = now
+            elapsed = now - self.start_time
+            speed = (self.downloaded - self.initial) / elapsed if elapsed > 0 else 0
+            downloaded = self.downloaded
+        self.callback(downloaded, self.total_size, speed)
+
+
+def _download_single(url, dest_path, headers, progress_callback):
+    """服务器不支持Range时退化为单连接顺序下载"""
+    with _open(url, headers) as response, open(dest_path, 'wb') as f:
+        total_size = int(response.headers.get('Content-Length') or 0)
+        counter = ProgressCounter(total_size, progress_callback)
+        while True:
+            data = response.read(READ_BUFFER_SIZE)
+            if not data:
+                break
+            f.write(data)
+            counter.add(len(data))
+
+    filesize = os.path.getsize(dest_path)
+    if total_size and filesize != total_size:
+        raise RangedDownloadError(f'Size mismatch: expected {total_size} bytes, got {filesize}')
+    return {'filesize': filesize, 'connections': 1}
+
+
+def stream_ranges(url, out_file, total_size, headers=None, chunk_size=DEFAULT_CHUNK_SIZE, on_data=None):
+    """
+    按顺序逐块请求并写入out_file（可以是管道），用于边下载边处理
+    on_data(size) 每写入一段数据调用一次
+    """
+    for start, end in split_ranges(total_size, chunk_size):
+        for attempt in range(RANGE_RETRIES):
+            try:
+                with _open(url, headers, (start, end)) as response:
+                    check_range_response(response, start, end, total_size)
+                    # 管道不能回退，重试时跳过已经写出的部分
+                    while True:
+                        data = response.read(READ_BUFFER_SIZE)
+                        if not data:
+                            break
+                        out_file.write(data)
+                        start += len(data)
+                        if on_data:
+                            on_data(len(data))
+                if start != end + 1:
+                    raise RangedDownloadError(f'Incomplete range: stopped at {start}, expected {end + 1}')
+                break
+            except (BrokenPipeError, ValueError, SizeMismatchError):
+                # 读取端已关闭或文件大小不符，无需重试
+                raise
+            except Exception:
+                if attempt == RANGE_RETRIES - 1:
+                    raise
+                time.sleep(attempt + 1)
+
+
+def download_file(url, dest_path, connections=DEFAULT_CONNECTIONS, headers=None,
+                  expected_size=None, progress_callback=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                  resolve_url=None):
+    """
+    多连接下载url到dest_path，支持断点续传
+    progress_callback(downloaded_bytes, total_bytes, speed_bytes_per_sec)
+    resolve_url() 在签名地址过期（403/410）时返回新的流地址
+    返回 {'filesize': 字节数, 'connections': 实际连接数, 'resumed_bytes': 复用的字节数}
+    """
+    url_holder = _UrlHolder(url, resolve_url)
+    try:
+        total_size = expected_size or probe_size(url, headers)
+    except urllib.error.HTTPError as e:
+        if e.code not in URL_EXPIRED_STATUS or not url_holder.refresh(url):
+            raise
+        total_size = probe_size(url_holder.url, headers)
+
+    if not total_size:
+        result = _download_single(url_holder.url, dest_path, headers, progress_callback)
+        result['resumed_bytes'] = 0
+        return result
+
+    journal = RangeJournal(dest_path, total_size, chunk_size)
+    if not journal.load(dest_path):
+        # 没有可用的日志：预分配文件，各连接直接写入各自的偏移位置
+        with open(dest_path, 'wb') as f:
+            f.truncate(total_size)
+
+    pending = queue.Queue()
+    for byte_range in split_ranges(total_size, chunk_size):
+        if byte_range not in journal.completed:
+            pending.put(byte_range)
+
+    resumed_bytes = journal.completed_bytes()
+    counter = ProgressCounter(total_size, progress_callback, downloaded=resumed_bytes)
+    errors = []
+
+    def fetch_range(f, start, end):
+        received = 0
+        current_url = url_holder.url
+        try:
+            with _open(current_url, headers, (start, end)) as response:
+                check_range_response(response, start, end, total_size)
+                f.seek(start)
+                while True:
+                    data = response.read(READ_BUFFER_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+                    received += len(data)
+                    counter.add(len(data))
+            if received != end - start + 1:
+                raise RangedDownloadError(f'Incomplete range {start}-{end}: got {received} bytes')
+            # 数据落盘后再记录到日志
+            f.flush()
+            os.fsync(f.fileno())
+            journal.mark_done((start, end))
+        except Exception as e:
+            # 失败的分段会整体重试，回退已计入的进度
+            counter.add(-received)
+            if isinstance(e, urllib.error.HTTPError) and e.code in URL_EXPIRED_STATUS:
+                if not url_holder.refresh(current_url):
+                    raise UrlExpiredError(f'Stream URL expired (HTTP {e.code})')
+            raise
+
+    def worker():
+        with open(dest_path, 'r+b') as f:
+            while not errors:
+                try:
+                    start, end = pending.get_nowait()
+                except queue.Empty:
+                    return
+                for attempt in range(RANGE_RETRIES):
+                    # 其它连接遇到不可恢复的错误时停止重试
+                    if errors:
+                        return
+                    try:
+                        fetch_range(f, start, end)
+                        break
+                    except (SizeMismatchError, UrlExpiredError) as e:
+                        errors.append(e)
+                        break
+                    except Exception as e:
+                        if attempt == RANGE_RETRIES - 1:
+                            errors.append(e)
+                        else:
+                            time.sleep(attempt + 1)
+
+    connections = max(1, min(connections, pending.qsize()))
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        # 保留部分文件和日志，下次重试时继续
+        raise RangedDownloadError(f'Range download failed: {errors[0]}')
+
+    filesize = os.path.getsize(dest_path)
+    if filesize != total_size or counter.downloaded != total_size:
+        journal.remove()
+        raise RangedDownloadError(
+            f'Size mismatch: expected {total_size} bytes, got {filesize} (received {counter.downloaded})')
+
+    journal.remove()
+    return {'filesize': filesize, 'connections': connections, 'resumed_bytes': resumed_bytes}
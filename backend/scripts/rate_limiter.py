@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+YouTube出站请求的自适应限流器
+令牌桶控制请求速率，速率按AIMD调整：
+- 请求成功时线性提高速率（加性增）
+- 遇到429 / 机器人验证（"confirm you're not a bot"）时速率减半并暂停一段时间（乘性减），连续被限流时暂停时间加倍
+- 被限流期间请求排队等待而不是直接失败，超过最长等待时间才返回错误
+- 低优先级请求（如预取）不排队：需要保留余量，且有前台请求在等待时直接让出
+状态保存在SQLite中，多个工作进程共享同一个速率
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'cache', 'rate_limiter.db')
+
+# 速率上下限（请求/秒）
+DEFAULT_MAX_RATE = float(os.environ.get('YOUTUBE_RATE_LIMIT_MAX', 2))
+DEFAULT_MIN_RATE = float(os.environ.get('YOUTUBE_RATE_LIMIT_MIN', 0.05))
+# 令牌桶容量，允许的最大突发请求数
+DEFAULT_BURST = float(os.environ.get('YOUTUBE_RATE_LIMIT_BURST', 5))
+# 每次成功后速率的增量（请求/秒）
+DEFAULT_INCREASE_STEP = float(os.environ.get('YOUTUBE_RATE_LIMIT_STEP', 0.1))
+# 被限流后的暂停时间（秒），连续被限流时加倍，不超过上限
+DEFAULT_COOLDOWN = float(os.environ.get('YOUTUBE_RATE_LIMIT_COOLDOWN', 30))
+MAX_COOLDOWN = float(os.environ.get('YOUTUBE_RATE_LIMIT_MAX_COOLDOWN', 600))
+# 请求排队的最长时间（秒）
+DEFAULT_MAX_WAIT = float(os.environ.get('YOUTUBE_RATE_LIMIT_MAX_WAIT', 120))
+
+# 低优先级请求取令牌后桶中至少要保留的令牌数，保证前台请求随时有预算
+LOW_PRIORITY_RESERVE = float(os.environ.get('YOUTUBE_RATE_LIMIT_LOW_RESERVE', 2))
+
+# 排队时单次睡眠的上限，便于及时感知其它进程对状态的修改
+MAX_SLEEP = 1.0
+
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+
+# 当前上下文中出站请求的默认优先级
+_current_priority = ContextVar('rate_limit_priority', default=PRIORITY_NORMAL)
+
+# 只匹配HTTP 429和机器人验证；年龄限制（"Sign in to confirm your age"）是单个视频的普通错误，不代表被限流
+THROTTLE_PATTERN = re.compile(r"\b429\b|Too Many Requests|confirm you['’]re not a bot", re.IGNORECASE)
+
+
+def is_throttle_message(message):
+    """判断错误信息是否表示被YouTube限流"""
+    return bool(THROTTLE_PATTERN.search(message or ''))
+
+
+class RateLimitTimeout(Exception):
+    """排队等待超过最长时间"""
+
+
+class RateLimitBusy(Exception):
+    """低优先级请求没有可用预算，已让出给前台请求"""
+
+
+def current_priority():
+    return _current_priority.get()
+
+
+@contextmanager
+def priority_scope(priority):
+    """在该范围内发出的请求默认使用指定优先级（子线程需要复制上下文）"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class AdaptiveRateLimiter:
+    """多进程共享的AIMD令牌桶"""
+
+    def __init__(self, name='youtube', db_path=None, max_rate=DEFAULT_MAX_RATE, min_rate=DEFAULT_MIN_RATE,
+                 burst=DEFAULT_BURST, increase_step=DEFAULT_INCREASE_STEP, cooldown=DEFAULT_COOLDOWN,
+                 max_wait=DEFAULT_MAX_WAIT):
+        self.name = name
+        self.db_path = db_path or os.environ.get('RATE_LIMIT_DB', DEFAULT_DB_PATH)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.increase_step = increase_step
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        with self._transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS limiter (
+                    name TEXT PRIMARY KEY,
+                    rate REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0,
+                    throttle_streak INTEGER NOT NULL DEFAULT 0,
+                    foreground_waiting_until REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(limiter)')}
+            if 'foreground_waiting_until' not in columns:
+                conn.execute('ALTER TABLE limiter ADD COLUMN foreground_waiting_until REAL NOT NULL DEFAULT 0')
+            conn.execute(
+                'INSERT OR IGNORE INTO limiter (name, rate, tokens, updated_at) VALUES (?, ?, ?, ?)',
+                (name, max_rate, burst, time.time()))
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE保证读-改-写在多个进程间是原子的
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def _load(self, conn, now):
+        """读取状态并按经过的时间补充令牌"""
+        rate, tokens, updated_at, blocked_until, streak = conn.execute(
+            'SELECT rate, tokens, updated_at, blocked_until, throttle_streak FROM limiter WHERE name = ?',
+            (self.name,)).fetchone()
+        # 暂停期间不补充令牌
+        refill_from = max(updated_at, min(blocked_until, now))
+        tokens = min(self.burst, tokens + max(0.0, now - refill_from) * rate)
+        return rate, tokens, blocked_until, streak
+
+    def try_acquire(self, priority=PRIORITY_NORMAL):
+        """
+        尝试取一个令牌，返回0表示成功，否则返回建议的等待秒数
+        前台请求需要等待时会标记"前台等待中"，期间低优先级请求一律让出
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rate, tokens, blocked_until, _ = self._load(conn, now)
+            foreground_waiting_until = conn.execute(
+                'SELECT foreground_waiting_until FROM limiter WHERE name = ?', (self.name,)).fetchone()[0]
+            required = 1 if priority == PRIORITY_NORMAL else 1 + LOW_PRIORITY_RESERVE
+
+            if blocked_until > now:
+                wait = blocked_until - now
+            elif priority != PRIORITY_NORMAL and foreground_waiting_until > now:
+                wait = foreground_waiting_until - now
+            elif tokens >= required:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (required - tokens) / rate
+
+            if wait and priority == PRIORITY_NORMAL:
+                foreground_waiting_until = max(foreground_waiting_until, now + min(wait, MAX_SLEEP) + MAX_SLEEP)
+            conn.execute('UPDATE limiter SET tokens = ?, updated_at = ?, foreground_waiting_until = ? WHERE name = ?',
+                         (tokens, now, foreground_waiting_until, self.name))
+        return wait
+
+    def acquire(self, max_wait=None, priority=PRIORITY_NORMAL):
+        """
+        排队直到取得令牌，超过最长等待时间时抛出RateLimitTimeout
+        低优先级请求不排队，没有预算时立即抛出RateLimitBusy
+        """
+        if priority != PRIORITY_NORMAL:
+            if self.try_acquire(priority) > 0:
+                raise RateLimitBusy('Low priority request yielded to foreground requests')
+            return
+
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.time() + max_wait
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise RateLimitTimeout(f'Waited {max_wait:g}s for a YouTube request slot')
+            time.sleep(min(wait, MAX_SLEEP, remaining))
+
+    def on_success(self):
+        """请求成功：加性提高速率，清除连续限流计数"""
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE limiter SET rate = MIN(?, rate + ?), throttle_streak = 0 WHERE name = ?',
+                (self.max_rate, self.increase_step, self.name))
+
+    def on_throttled(self):
+        """被限流：速率减半，清空令牌并暂停，连续被限流时暂停时间加倍"""
+        now = time.time()
+        with self._transaction() as conn:
+            rate, _, blocked_until, streak = self._load(conn, now)
+            pause = min(MAX_COOLDOWN, self.cooldown * (2 ** streak))
+            conn.execute(
+                'UPDATE limiter SET rate = ?, tokens = 0, updated_at = ?, blocked_until = ?, '
+                'throttle_streak = ? WHERE name = ?',
+                (max(self.min_rate, rate / 2), now, max(blocked_until, now + pause), streak + 1, self.name))
+
+    @contextmanager
+    def request(self, max_wait=None, priority=PRIORITY_NORMAL):
+        """包裹一次出站请求：先排队取令牌，再根据结果调整速率"""
+        self.acquire(max_wait, priority)
+        try:
+            yield
+        except Exception as e:
+            if is_throttle_message(str(e)):
+                self.on_throttled()
+            raise
+        self.on_success()
+
+    def report(self, success, message=None):
+        """报告一次请求的结果（用于无法用异常区分结果的调用方，如子进程）"""
+        if success:
+            self.on_success()
+        elif is_throttle_message(message):
+            self.on_throttled()
+
+    def state(self):
+        now = time.time()
+        with self._transaction() as conn:
+            rate, tokens, blocked_until, streak = self._load(conn, now)
+        return {
+            'name': self.name,
+            'rate': round(rate, 3),
+            'tokens': round(tokens, 2),
+            'blocked_for': round(max(0.0, blocked_until - now), 1),
+            'throttle_streak': streak,
+        }
+
+    def reset(self):
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE limiter SET rate = ?, tokens = ?, updated_at = ?, blocked_until = 0, throttle_streak = 0 '
+                'WHERE name = ?', (self.max_rate, self.burst, time.time(), self.name))
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def get_default_limiter():
+    """获取YouTube请求的默认限流器，设置YOUTUBE_RATE_LIMIT=0可禁用"""
+    global _default_limiter
+    if os.environ.get('YOUTUBE_RATE_LIMIT', '1') == '0':
+        return None
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            try:
+                _default_limiter = AdaptiveRateLimiter()
+            except (OSError, sqlite3.Error):
+                # 状态文件不可用时不限流
+                return None
+        return _default_limiter
+
+
+@contextmanager
+def request_slot(max_wait=None, priority=None):
+    """
+    在默认限流器下执行一次YouTube请求，限流器不可用时直接执行
+    未指定优先级时使用priority_scope设置的当前优先级
+    """
+    limiter = get_default_limiter()
+    if limiter is None:
+        yield
+        return
+    with limiter.request(max_wait, priority or current_priority()):
+        yield
+
+
+def main():
+    """命令行接口：查看或重置限流状态"""
+    if len(sys.argv) != 2 or sys.argv[1] not in ('state', 'reset'):
+        print(json.dumps({
+            'success': False,
+            'error': 'Usage: python rate_limiter.py <state|reset>'
+        }))
+        sys.exit(1)
+
+    limiter = AdaptiveRateLimiter()
+    if sys.argv[1] == 'reset':
+        limiter.reset()
+    result = {'success': True}
+    result.update(limiter.state())
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
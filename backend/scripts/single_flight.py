@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+进程内请求合并（single flight）
+同一个键的并发调用只执行一次，所有调用方得到同一个结果（包括错误结果）
+失败结果在短时间内继续返回给后来的调用方，避免对上游的重复冲击
+"""
+
+import os
+import threading
+import time
+
+DEFAULT_FAILURE_TTL = float(os.environ.get('SINGLE_FLIGHT_FAILURE_TTL', 5))
+# 失败结果缓存的条目上限，常驻进程中不随失败的键无限增长
+MAX_FAILURES = 1024
+
+
+class _Call:
+    """一次进行中的调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """按键合并并发调用，调用结果为success字段的字典"""
+
+    def __init__(self, failure_ttl=DEFAULT_FAILURE_TTL):
+        self.failure_ttl = failure_ttl
+        self._calls = {}
+        # 失败结果的短期缓存：key -> (过期时间, 结果)，按写入顺序排列（即按过期时间排列）
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """执行fn()，同一个键同时只有一个调用在执行"""
+        with self._lock:
+            failure = self._failures.get(key)
+            if failure:
+                expires_at, result = failure
+                if expires_at > time.time():
+                    return dict(result)
+                del self._failures[key]
+
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return dict(call.result)
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                if call.result is not None and not call.result.get('success') and self.failure_ttl > 0:
+                    self._remember_failure(key, call.result)
+            call.event.set()
+
+        return dict(call.result)
+
+    def _remember_failure(self, key, result):
+        """写入失败结果，同时清理已过期的条目并限制条目数（调用方持有锁）"""
+        now = time.time()
+        self._failures.pop(key, None)
+        self._failures[key] = (now + self.failure_ttl, result)
+        while self._failures:
+            oldest = next(iter(self._failures))
+            expires_at, _ = self._failures[oldest]
+            if expires_at > now and len(self._failures) <= MAX_FAILURES:
+                break
+            del self._failures[oldest]
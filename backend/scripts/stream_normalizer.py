@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+统一的流信息整理
+yewtube_service、youtube_info_ytdlp和youtube_info（pytube）共用，保证各后端输出一致：
+- 各后端的格式先转换为同样的流记录，高度/码率/帧率保存为整数，类别用位标志表示
+- 单次遍历完成分类，排序键在转换时预先计算，不再解析'720p'、'128kbps'之类的字符串
+"""
+
+import re
+from operator import itemgetter
+
+# 流类别位标志
+VIDEO = 0x1
+AUDIO = 0x2
+PROGRESSIVE = VIDEO | AUDIO
+
+_LEADING_NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+
+
+def _to_int(value):
+    """数值或形如'720p'、'128kbps'的字符串转换为整数，无法转换时返回None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(round(value))
+    match = _LEADING_NUMBER_PATTERN.match(str(value))
+    return int(round(float(match.group(0)))) if match else None
+
+
+def make_stream(itag, mime_type, subtype, flags, filesize=None, height=None, fps=None, abr=None,
+                video_codec=None, audio_codec=None, url=None):
+    """生成流记录，输出字段与原有接口一致，另附数值字段和类别标志"""
+    filesize = filesize or 0
+    stream = {
+        'itag': itag,
+        'mime_type': mime_type,
+        'type': 'video' if flags & VIDEO else 'audio',
+        'subtype': subtype,
+        'filesize': filesize,
+        'filesize_mb': round(filesize / 1024 / 1024, 2) if filesize else 0,
+        'is_progressive': flags == PROGRESSIVE,
+        'includes_audio_track': bool(flags & AUDIO),
+        'includes_video_track': bool(flags & VIDEO),
+        'category': flags,
+    }
+    if url:
+        stream['url'] = url
+
+    if flags & VIDEO:
+        height = _to_int(height)
+        fps = _to_int(fps)
+        stream.update({
+            'resolution': f'{height}p' if height else None,
+            'height': height,
+            'fps': fps,
+            'video_codec': video_codec,
+        })
+    elif flags & AUDIO:
+        abr = _to_int(abr)
+        stream.update({
+            'abr': f'{abr}kbps' if abr else None,
+            'abr_kbps': abr,
+            'audio_codec': audio_codec,
+        })
+    return stream
+
+
+def stream_from_ytdlp(fmt, include_url=False):
+    """yt-dlp格式转换为流记录，storyboard等不含音视频的格式返回None"""
+    vcodec = fmt.get('vcodec')
+    acodec = fmt.get('acodec')
+    flags = (VIDEO if vcodec != 'none' else 0) | (AUDIO if acodec != 'none' else 0)
+    if not flags or fmt.get('format_note') == 'storyboard':
+        return None
+
+    ext = fmt.get('ext')
+    return make_stream(
+        itag=fmt.get('format_id'),
+        mime_type=ext,
+        subtype=ext,
+        flags=flags,
+        filesize=fmt.get('filesize') or fmt.get('filesize_approx'),
+        height=fmt.get('height'),
+        fps=fmt.get('fps'),
+        abr=fmt.get('abr'),
+        video_codec=vcodec,
+        audio_codec=acodec,
+        url=fmt.get('url') if include_url else None,
+    )
+
+
+def stream_from_pytube(stream):
+    """pytube的Stream转换为流记录"""
+    flags = ((VIDEO if stream.includes_video_track else 0)
+             | (AUDIO if stream.includes_audio_track else 0))
+    return make_stream(
+        itag=stream.itag,
+        mime_type=stream.mime_type,
+        subtype=stream.subtype,
+        flags=flags,
+        filesize=stream.filesize,
+        height=getattr(stream, 'resolution', None),
+        fps=getattr(stream, 'fps', None),
+        abr=getattr(stream, 'abr', None),
+        video_codec=getattr(stream, 'video_codec', None),
+        audio_codec=getattr(stream, 'audio_codec', None),
+    )
+
+
+def normalize_streams(streams):
+    """
+    单次遍历整理流记录（None会被跳过）
+    返回 {'streams': {all, video_only, audio_only, progressive}, 'recommended': [...]}
+    """
+    all_streams = []
+    video_only = []
+    audio_only = []
+    progressive = []
+
+    for stream in streams:
+        if stream is None:
+            continue
+        all_streams.append(stream)
+        flags = stream['category']
+        if flags == PROGRESSIVE:
+            progressive.append(((stream['height'] or 0, stream['fps'] or 0), stream))
+        elif flags == VIDEO:
+            video_only.append(((stream['height'] or 0, stream['fps'] or 0), stream))
+        elif flags == AUDIO:
+            audio_only.append((stream['abr_kbps'] or 0, stream))
+
+    # 按质量从高到低排序（键已预先计算，排序稳定）
+    for entries in (video_only, audio_only, progressive):
+        entries.sort(key=itemgetter(0), reverse=True)
+    video_only = [stream for _, stream in video_only]
+    audio_only = [stream for _, stream in audio_only]
+    progressive = [stream for _, stream in progressive]
+
+    return {
+        'streams': {
+            'all': all_streams,
+            'video_only': video_only,
+            'audio_only': audio_only,
+            'progressive': progressive,
+        },
+        'recommended': build_recommended(progressive, audio_only),
+    }
+
+
+def build_recommended(progressive, audio_only):
+    """根据已排序的流生成推荐格式"""
+    recommended = []
+
+    # 推荐1：最佳progressive流（音视频合并）
+    best_progressive = next((s for s in progressive if s['height']), None)
+    if best_progressive:
+        recommended.append({
+            'id': 'best_progressive',
+            'name': '推荐：最佳质量（音视频合并）',
+            'itag': best_progressive['itag'],
+            'description': f"{best_progressive['resolution']} {best_progressive['subtype']}格式",
+            'type': 'progressive'
+        })
+
+    # 推荐2：720p progressive
+    stream_720p = next((s for s in progressive if s['height'] == 720), None)
+    if stream_720p:
+        recommended.append({
+            'id': '720p_progressive',
+            'name': '推荐：720p高清',
+            'itag': stream_720p['itag'],
+            'description': f"720p {stream_720p['subtype']}格式，兼容性好",
+            'type': 'progressive'
+        })
+
+    # 推荐3：最佳音频
+    if audio_only:
+        best_audio = audio_only[0]
+        recommended.append({
+            'id': 'best_audio',
+            'name': '推荐：最佳音质',
+            'itag': best_audio['itag'],
+            'description': f"{best_audio['abr'] or ''} {best_audio['subtype']}格式".strip(),
+            'type': 'audio'
+        })
+
+    return recommended
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+缩略图代理缓存
+- 解析结果中的上游缩略图地址登记后换成本地地址（/thumbnail/<key>?w=<宽度>），只有登记过的地址才会被代理
+- 按需下载并缩放到几个标准宽度（需要Pillow，未安装时返回原图），保存在有大小上限的磁盘LRU缓存中
+- 缓存过期后用ETag/Last-Modified向上游发条件请求，未变化时只刷新时间
+- 每张图片旁有一个<文件>.json说明文件（类型、过期时间），Node直接读取它提供未过期的图片，
+  只有未命中、已过期或需要缩放时才交给常驻的yewtube_service工作进程；Node命中时更新图片文件的修改时间，
+  淘汰时与索引中的访问时间一起作为最近访问时间
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from functools import lru_cache
+from io import BytesIO
+from urllib.parse import quote
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'cache', 'thumbnails')
+DEFAULT_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+# 缓存的图片在这段时间内直接使用，之后向上游重新验证（秒）
+DEFAULT_TTL = int(os.environ.get('THUMBNAIL_TTL', 24 * 3600))
+# 登记的上游地址保留时间（秒）
+SOURCE_TTL = int(os.environ.get('THUMBNAIL_SOURCE_TTL', 7 * 24 * 3600))
+# 标准宽度，其它宽度向上取最接近的标准宽度
+STANDARD_WIDTHS = tuple(sorted(int(w) for w in os.environ.get('THUMBNAIL_WIDTHS', '120,320,480').split(',') if w.strip()))
+DEFAULT_WIDTH = 320
+JPEG_QUALITY = 85
+URL_PREFIX = os.environ.get('THUMBNAIL_URL_PREFIX', '/api/tools/youtube/thumbnail')
+REQUEST_TIMEOUT = 15
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+
+class ThumbnailError(Exception):
+    """缩略图获取失败"""
+
+
+def make_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+
+@lru_cache(maxsize=None)
+def has_pillow():
+    """是否安装了Pillow（只查找不导入，Pillow在第一次缩放时才导入）"""
+    return importlib.util.find_spec('PIL') is not None
+
+
+def normalize_width(width):
+    """把请求的宽度归到标准宽度；0或未安装Pillow时使用原图"""
+    if not width or not has_pillow():
+        return 0
+    for standard in STANDARD_WIDTHS:
+        if width <= standard:
+            return standard
+    return STANDARD_WIDTHS[-1] if STANDARD_WIDTHS else 0
+
+
+def resize_image(data, width):
+    """按宽度等比缩小并编码为JPEG，原图不比目标宽时保留原图"""
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:
+        if image.width <= width:
+            return data, Image.MIME.get(image.format, 'image/jpeg')
+        height = max(1, round(image.height * width / image.width))
+        resized = image.convert('RGB').resize((width, height), Image.LANCZOS)
+        output = BytesIO()
+        resized.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+        return output.getvalue(), 'image/jpeg'
+
+
+class ThumbnailCache:
+    """缩略图磁盘缓存（多进程共享同一个目录和索引）"""
+
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.root = os.path.abspath(root or os.environ.get('THUMBNAIL_CACHE_DIR', DEFAULT_CACHE_DIR))
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.images_dir = os.path.join(self.root, 'images')
+        self.index_path = os.path.join(self.root, 'index.db')
+        os.makedirs(self.images_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sources (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    registered_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS images (
+                    key TEXT NOT NULL,
+                    width INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (key, width)
+                )
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def register(self, urls):
+        """登记上游地址，返回 {地址: key}"""
+        now = time.time()
+        keys = {url: make_key(url) for url in urls if url and url.startswith(('http://', 'https://'))}
+        if not keys:
+            return {}
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO sources (key, url, registered_at) VALUES (?, ?, ?)',
+                [(key, url, now) for url, key in keys.items()])
+            conn.execute('DELETE FROM sources WHERE registered_at <= ?', (now - SOURCE_TTL,))
+        return keys
+
+    def _download(self, url, etag=None, last_modified=None):
+        """下载上游图片，返回 (数据, 响应头)，未变化时数据为None"""
+        headers = dict(DEFAULT_HEADERS)
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers),
+                                        timeout=REQUEST_TIMEOUT) as response:
+                return response.read(), response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None, e.headers
+            raise ThumbnailError(f'Upstream returned HTTP {e.code}')
+        except (urllib.error.URLError, OSError) as e:
+            raise ThumbnailError(f'Failed to fetch thumbnail: {e}')
+
+    def fetch(self, key, width=DEFAULT_WIDTH):
+        """
+        获取登记过的缩略图
+        返回 {'path', 'content_type', 'size', 'status'}，status为hit/revalidated/fetched
+        """
+        width = normalize_width(width)
+        now = time.time()
+        with self._connect() as conn:
+            source = conn.execute('SELECT url FROM sources WHERE key = ?', (key,)).fetchone()
+            row = conn.execute('SELECT * FROM images WHERE key = ? AND width = ?', (key, width)).fetchone()
+        if not source:
+            raise ThumbnailError('Unknown thumbnail key')
+
+        cached = dict(row) if row and os.path.exists(row['path']) else None
+        if cached and cached['fetched_at'] > now - self.ttl:
+            self._touch(key, width, now)
+            return self._entry(cached, 'hit')
+
+        try:
+            data, headers = self._download(source['url'],
+                                           cached and cached['etag'], cached and cached['last_modified'])
+        except ThumbnailError:
+            # 上游不可用时继续使用过期的缓存
+            if cached:
+                return self._entry(cached, 'stale')
+            raise
+
+        if data is None and cached:
+            with self._connect() as conn:
+                conn.execute('UPDATE images SET fetched_at = ?, last_access = ? WHERE key = ? AND width = ?',
+                             (now, now, key, width))
+            cached['fetched_at'] = now
+            self._write_meta(cached)
+            return self._entry(cached, 'revalidated')
+        if data is None:
+            # 没有缓存却收到304，重新无条件下载
+            data, headers = self._download(source['url'])
+
+        content_type = headers.get('Content-Type') or 'image/jpeg'
+        if width:
+            try:
+                data, content_type = resize_image(data, width)
+            except (OSError, ValueError):
+                # 无法识别的图片格式，保留原图
+                pass
+
+        path = os.path.join(self.images_dir, f'{key}_{width}')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        entry = {
+            'key': key,
+            'width': width,
+            'path': path,
+            'content_type': content_type.split(';')[0].strip(),
+            'size': len(data),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'fetched_at': now,
+            'last_access': now,
+        }
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO images (key, width, path, content_type, size, etag, last_modified, '
+                'fetched_at, last_access) VALUES (:key, :width, :path, :content_type, :size, :etag, '
+                ':last_modified, :fetched_at, :last_access)', entry)
+        self._write_meta(entry)
+        self.evict()
+        return self._entry(entry, 'fetched')
+
+    def _write_meta(self, entry):
+        """写入供Node直接读取的说明文件"""
+        meta_path = entry['path'] + '.json'
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'content_type': entry['content_type'],
+                'expires_at': entry['fetched_at'] + self.ttl,
+                # 未安装Pillow时所有宽度都使用原图（宽度0）
+                'pillow': has_pillow(),
+            }, f)
+        os.replace(tmp_path, meta_path)
+
+    def _touch(self, key, width, now):
+        with self._connect() as conn:
+            conn.execute('UPDATE images SET last_access = ? WHERE key = ? AND width = ?', (now, key, width))
+
+    @staticmethod
+    def _entry(row, status):
+        return {
+            'path': row['path'],
+            'content_type': row['content_type'],
+            'size': row['size'],
+            'status': status,
+        }
+
+    def evict(self):
+        """总大小超过上限时按最近访问时间淘汰"""
+        with self._connect() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM images').fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            rows = conn.execute('SELECT key, width, path, size, last_access FROM images').fetchall()
+            evicted = 0
+            for row in sorted(rows, key=self._last_access):
+                if total <= self.max_bytes:
+                    break
+                for path in (row['path'], row['path'] + '.json'):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                conn.execute('DELETE FROM images WHERE key = ? AND width = ?', (row['key'], row['width']))
+                total -= row['size']
+                evicted += 1
+            return evicted
+
+    @staticmethod
+    def _last_access(row):
+        """索引中的访问时间和Node命中时更新的文件修改时间取较晚者"""
+        try:
+            return max(row['last_access'], os.path.getmtime(row['path']))
+        except OSError:
+            return row['last_access']
+
+    def stats(self):
+        with self._connect() as conn:
+            images = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images').fetchone()
+            sources = conn.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+        return {'images': images[0], 'total_bytes': images[1], 'max_bytes': self.max_bytes, 'sources': sources}
+
+
+def local_url(key, width=DEFAULT_WIDTH):
+    return f'{URL_PREFIX}/{quote(key)}?w={width}'
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_thumbnail_cache():
+    """获取默认缩略图缓存，设置THUMBNAIL_PROXY=0可禁用"""
+    global _default_cache
+    if os.environ.get('THUMBNAIL_PROXY', '1') == '0':
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = ThumbnailCache()
+            except (OSError, sqlite3.Error):
+                return None
+        return _default_cache
+
+
+def add_local_thumbnails(items, field):
+    """
+    为结果中的缩略图地址登记并添加本地地址字段（原字段保持不变）：
+    <field>_local 为默认宽度的本地地址，<field>_sizes 为各标准宽度的本地地址
+    缓存不可用时不添加字段
+    """
+    cache = get_default_thumbnail_cache()
+    if not cache:
+        return items
+    try:
+        keys = cache.register([item.get(field) for item in items])
+    except (OSError, sqlite3.Error):
+        return items
+
+    widths = STANDARD_WIDTHS if has_pillow() else (0,)
+    for item in items:
+        key = keys.get(item.get(field))
+        if key:
+            item[f'{field}_local'] = local_url(key, DEFAULT_WIDTH if has_pillow() else 0)
+            item[f'{field}_sizes'] = {str(width): local_url(key, width) for width in widths}
+    return items
+
+
+def main():
+    """命令行接口：获取缩略图、查看统计、手动淘汰"""
+    if len(sys.argv) < 2 or sys.argv[1] not in ('fetch', 'stats', 'evict'):
+        print(json.dumps({
+            'success': False,
+            'error': 'Usage: python thumbnail_cache.py <fetch <key> [width]|stats|evict>'
+        }))
+        sys.exit(1)
+
+    cache = ThumbnailCache()
+    command = sys.argv[1]
+    if command == 'fetch':
+        if len(sys.argv) not in (3, 4) or (len(sys.argv) == 4 and not sys.argv[3].isdigit()):
+            print(json.dumps({'success': False, 'error': 'Usage: python thumbnail_cache.py fetch <key> [width]'}))
+            sys.exit(1)
+        width = int(sys.argv[3]) if len(sys.argv) == 4 else DEFAULT_WIDTH
+        try:
+            result = {'success': True}
+            result.update(cache.fetch(sys.argv[2], width))
+        except ThumbnailError as e:
+            result = {'success': False, 'error': str(e), 'error_type': 'thumbnail_failed'}
+    elif command == 'stats':
+        result = {'success': True}
+        result.update(cache.stats())
+    else:
+        result = {'success': True, 'evicted': cache.evict()}
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
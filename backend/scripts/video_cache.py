@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+YouTube视频信息磁盘缓存
+基于SQLite，按视频ID和cookies身份缓存get_video_info的结果
+静态元数据（标题、作者、关键词等）与带签名的流地址分别计算过期时间
+同一个数据库中还缓存搜索结果页（按规范化的查询和续页键）
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), '..', 'cache', 'video_cache.db')
+
+# 元数据缓存时间（秒）
+DEFAULT_METADATA_TTL = int(os.environ.get('YEWTUBE_METADATA_TTL', 6 * 3600))
+# 流地址中没有expire参数时使用的缓存时间（秒）
+DEFAULT_STREAM_TTL = int(os.environ.get('YEWTUBE_STREAM_TTL', 3600))
+# 流地址提前失效的安全余量（秒），避免把即将过期的地址交给下载
+STREAM_EXPIRY_MARGIN = int(os.environ.get('YEWTUBE_STREAM_EXPIRY_MARGIN', 300))
+
+# 搜索结果页的缓存时间（秒）和最多保留的页数
+DEFAULT_SEARCH_TTL = int(os.environ.get('YEWTUBE_SEARCH_TTL', 1800))
+DEFAULT_SEARCH_MAX_PAGES = int(os.environ.get('YEWTUBE_SEARCH_CACHE_MAX', 1000))
+
+_EXPIRE_PATH_PATTERN = re.compile(r'/expire/(\d+)')
+
+
+def get_cookie_identity(cookies_path):
+    """根据cookies文件内容生成身份标识，未使用cookies时返回anonymous"""
+    if not cookies_path or not os.path.exists(cookies_path):
+        return 'anonymous'
+    try:
+        with open(cookies_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()[:16]
+    except OSError:
+        return 'anonymous'
+
+
+def parse_stream_expiry(url):
+    """从googlevideo地址中解析expire时间戳（查询参数或路径形式）"""
+    if not url:
+        return None
+    try:
+        expire = parse_qs(urlparse(url).query).get('expire')
+        if expire and expire[0].isdigit():
+            return int(expire[0])
+        match = _EXPIRE_PATH_PATTERN.search(url)
+        if match:
+            return int(match.group(1))
+    except ValueError:
+        pass
+    return None
+
+
+def get_streams_expiry(video_info, now=None):
+    """计算视频信息中所有流地址的最早失效时间"""
+    now = now or time.time()
+    expiries = []
+    for stream in (video_info.get('streams') or {}).get('all', []):
+        expire = parse_stream_expiry(stream.get('url'))
+        if expire:
+            expiries.append(expire)
+
+    if expiries:
+        return min(expiries) - STREAM_EXPIRY_MARGIN
+    return now + DEFAULT_STREAM_TTL
+
+
+class VideoInfoCache:
+    """视频信息缓存（多进程共享同一个SQLite文件）"""
+
+    def __init__(self, db_path=None, metadata_ttl=DEFAULT_METADATA_TTL):
+        self.db_path = db_path or os.environ.get('YEWTUBE_CACHE_DB', DEFAULT_CACHE_PATH)
+        self.metadata_ttl = metadata_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS video_info (
+                    video_id TEXT NOT NULL,
+                    cookie_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    metadata_expires_at REAL NOT NULL,
+                    streams_expires_at REAL NOT NULL,
+                    PRIMARY KEY (video_id, cookie_id)
+                )
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作使用独立连接，便于在线程池和多个进程中使用
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, video_id, cookie_id, require_streams=True):
+        """
+        读取缓存
+        require_streams为True时，流地址过期即视为未命中；
+        为False时只要元数据未过期就返回（流地址过期时移除streams）
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT payload, created_at, metadata_expires_at, streams_expires_at '
+                'FROM video_info WHERE video_id = ? AND cookie_id = ?',
+                (video_id, cookie_id)
+            ).fetchone()
+
+        if not row:
+            return None
+
+        payload, created_at, metadata_expires_at, streams_expires_at = row
+        if metadata_expires_at <= now:
+            return None
+
+        streams_fresh = streams_expires_at > now
+        if require_streams and not streams_fresh:
+            return None
+
+        video_info = json.loads(payload)
+        if not streams_fresh:
+            video_info.pop('streams', None)
+            video_info.pop('recommended', None)
+
+        video_info['cache'] = {
+            'hit': True,
+            'age': round(now - created_at, 1),
+            'streams_fresh': streams_fresh,
+        }
+        return video_info
+
+    def put(self, video_id, cookie_id, video_info):
+        """写入缓存，仅缓存成功的结果"""
+        if not video_info.get('success'):
+            return
+
+        now = time.time()
+        video_info = {k: v for k, v in video_info.items() if k != 'cache'}
+        metadata_expires_at = now + self.metadata_ttl
+        streams_expires_at = min(get_streams_expiry(video_info, now), metadata_expires_at)
+
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO video_info '
+                '(video_id, cookie_id, payload, created_at, metadata_expires_at, streams_expires_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (video_id, cookie_id, json.dumps(video_info, ensure_ascii=False),
+                 now, metadata_expires_at, streams_expires_at)
+            )
+            # 顺带清理已完全过期的记录
+            conn.execute('DELETE FROM video_info WHERE metadata_expires_at <= ?', (now,))
+
+    def invalidate(self, video_id, cookie_id=None):
+        """删除指定视频的缓存"""
+        with self._connect() as conn:
+            if cookie_id is None:
+                conn.execute('DELETE FROM video_info WHERE video_id = ?', (video_id,))
+            else:
+                conn.execute('DELETE FROM video_info WHERE video_id = ? AND cookie_id = ?',
+                             (video_id, cookie_id))
+
+
+def normalize_query(query):
+    """规范化搜索词：全角转半角（NFKC）、忽略大小写、合并空白"""
+    return ' '.join(unicodedata.normalize('NFKC', query or '').casefold().split())
+
+
+class SearchCache:
+    """搜索结果页缓存，过期时间加LRU数量上限"""
+
+    def __init__(self, db_path=None, ttl=DEFAULT_SEARCH_TTL, max_pages=DEFAULT_SEARCH_MAX_PAGES):
+        self.db_path = db_path or os.environ.get('YEWTUBE_CACHE_DB', DEFAULT_CACHE_PATH)
+        self.ttl = ttl
+        self.max_pages = max_pages
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS search_pages (
+                    query TEXT NOT NULL,
+                    page_key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (query, page_key)
+                )
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, query, page_key=None):
+        """读取一页结果，返回 (结果列表, 下一页键)，未命中或已过期时返回None"""
+        now = time.time()
+        key = (normalize_query(query), page_key or '')
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT payload FROM search_pages WHERE query = ? AND page_key = ? AND created_at > ?',
+                key + (now - self.ttl,)
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute('UPDATE search_pages SET last_access = ? WHERE query = ? AND page_key = ?',
+                         (now,) + key)
+
+        payload = json.loads(row[0])
+        return payload['results'], payload['next']
+
+    def put(self, query, page_key, results, next_key):
+        """写入一页结果，并清理过期和超出数量上限的页"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO search_pages (query, page_key, payload, created_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (normalize_query(query), page_key or '',
+                 json.dumps({'results': results, 'next': next_key}, ensure_ascii=False), now, now)
+            )
+            conn.execute('DELETE FROM search_pages WHERE created_at <= ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM search_pages WHERE rowid IN ('
+                'SELECT rowid FROM search_pages ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (self.max_pages,)
+            )
+
+
+_default_cache = None
+_default_search_cache = None
+
+
+def get_default_cache():
+    """获取进程内共享的默认缓存实例，设置YEWTUBE_INFO_CACHE=0可禁用"""
+    global _default_cache
+    if os.environ.get('YEWTUBE_INFO_CACHE', '1') == '0':
+        return None
+    if _default_cache is None:
+        try:
+            _default_cache = VideoInfoCache()
+        except (OSError, sqlite3.Error):
+            # 缓存目录不可写时退化为无缓存模式
+            return None
+    return _default_cache
+
+
+def get_default_search_cache():
+    """获取进程内共享的搜索缓存实例，设置YEWTUBE_SEARCH_CACHE=0可禁用"""
+    global _default_search_cache
+    if os.environ.get('YEWTUBE_SEARCH_CACHE', '1') == '0':
+        return None
+    if _default_search_cache is None:
+        try:
+            _default_search_cache = SearchCache()
+        except (OSError, sqlite3.Error):
+            return None
+    return _default_search_cache
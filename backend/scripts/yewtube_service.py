@@ -2,17 +2,72 @@
 """
 基于yewtube技术的YouTube服务
 使用yt-dlp和youtube-search-python，无需API密钥和cookies
+yt-dlp和youtube-search-python在首次使用时才导入，--startup-profile可查看各模块的导入耗时
 """
 
+import atexit
+import base64
+import contextvars
+import importlib
 import json
 import os
+import shutil
+import subprocess
 import sys
+import threading
 import traceback
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import parse_qs, urlparse
 
-import yt_dlp
-from youtubesearchpython import VideosSearch, Video
+import ranged_downloader
+from download_store import get_default_store, make_store_key
+from output_format import OutputFormatError, pop_format_arg, write_result
+from rate_limiter import (PRIORITY_LOW, RateLimitBusy, RateLimitTimeout, current_priority, priority_scope,
+                          request_slot)
+from single_flight import SingleFlight
+from stream_normalizer import normalize_streams, stream_from_ytdlp
+from thumbnail_cache import ThumbnailError, add_local_thumbnails, get_default_thumbnail_cache
+from video_cache import get_cookie_identity, get_default_cache, get_default_search_cache
+
+COOKIES_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', 'cookies.txt')
+
+# 延迟导入的模块及其导入耗时（毫秒）
+_import_timings = {}
+_module_loaded_at = time.perf_counter()
+
+
+def _lazy_import(name):
+    """首次使用时导入模块并记录耗时"""
+    module = sys.modules.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        _import_timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    return module
+
+
+class _NotRaised(Exception):
+    """yt-dlp尚未导入时的占位异常，不会被抛出"""
+
+
+def _download_error():
+    """
+    供except子句使用的yt-dlp DownloadError
+    yt-dlp尚未导入时不可能抛出该异常，返回占位类而不是为了except子句导入yt-dlp
+    """
+    utils = sys.modules.get('yt_dlp.utils')
+    return utils.DownloadError if utils else _NotRaised
+
+
+def _new_youtube_dl(ydl_opts):
+    """创建只注册YouTube提取器的YoutubeDL，不加载yt-dlp的全部提取器"""
+    yt_dlp = _lazy_import('yt_dlp')
+    youtube_extractor = _lazy_import('yt_dlp.extractor.youtube')
+    ydl = yt_dlp.YoutubeDL(ydl_opts, auto_init=False)
+    ydl.add_info_extractor(youtube_extractor.YoutubeIE())
+    return ydl
 
 
 class YouTubeLogger:
@@ -31,6 +86,37 @@ class YouTubeLogger:
         pass
 
 
+# 常驻模式下复用的yt-dlp实例，避免每个请求重新构造YoutubeDL
+_info_ydl = None
+_info_ydl_lock = threading.Lock()
+
+
+def get_info_ydl():
+    """获取用于信息提取的共享YoutubeDL实例"""
+    global _info_ydl
+    with _info_ydl_lock:
+        if _info_ydl is None:
+            ydl_opts = {
+                'logger': YouTubeLogger(),
+                'quiet': True,
+                'no_warnings': True,
+                'extract_flat': False,
+            }
+
+            # 检查cookies文件
+            if os.path.exists(COOKIES_PATH):
+                ydl_opts['cookiefile'] = COOKIES_PATH
+
+            _info_ydl = _new_youtube_dl(ydl_opts)
+            # 退出时关闭实例（与with语句一致，会写回cookies）
+            atexit.register(_info_ydl.close)
+        return _info_ydl
+
+
+# 合并同一视频的并发信息请求
+_info_flight = SingleFlight()
+
+
 def extract_video_id(url):
     """从YouTube URL中提取视频ID"""
     try:
@@ -47,8 +133,150 @@ def extract_video_id(url):
         return None
 
 
-def get_video_info(url_or_id):
-    """获取YouTube视频信息"""
+# 元数据获取策略：
+#   ytdlp  - 只使用yt-dlp（单一来源，默认）
+#   race   - yt-dlp与youtube-search-python并发请求，取先返回的完整结果
+#   merged - 两个来源并发请求，以yt-dlp为准并用基本信息补全缺失字段
+INFO_STRATEGIES = ('ytdlp', 'race', 'merged')
+DEFAULT_INFO_STRATEGY = os.environ.get('YEWTUBE_INFO_STRATEGY', 'ytdlp')
+
+# 可从基本信息补全的字段
+MERGEABLE_FIELDS = ('title', 'duration', 'view_count', 'average_rating', 'uploader',
+                    'description', 'thumbnail', 'upload_date', 'uploader_url', 'tags')
+
+
+def _fetch_ytdlp_info(video_id):
+    """通过yt-dlp提取完整信息（含流地址）"""
+    with request_slot():
+        return get_info_ydl().extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+
+
+def _convert_basic_format(fmt):
+    """把streamingData中的格式转换为yt-dlp格式字段"""
+    # mimeType形如：video/mp4; codecs="avc1.4d401e, mp4a.40.2"
+    mime_type, _, codecs_part = (fmt.get('mimeType') or '').partition(';')
+    kind, _, ext = mime_type.strip().partition('/')
+    codecs = []
+    if 'codecs=' in codecs_part:
+        codecs = [c.strip() for c in codecs_part.split('=', 1)[1].strip().strip('"').split(',') if c.strip()]
+
+    if kind == 'video':
+        vcodec = codecs[0] if codecs else 'unknown'
+        acodec = codecs[1] if len(codecs) > 1 else 'none'
+    else:
+        vcodec = 'none'
+        acodec = codecs[0] if codecs else 'unknown'
+        ext = 'm4a' if ext == 'mp4' else ext
+
+    bitrate = fmt.get('averageBitrate') or fmt.get('bitrate')
+    content_length = fmt.get('contentLength')
+    return {
+        'format_id': str(fmt.get('itag')),
+        'ext': ext or None,
+        'vcodec': vcodec,
+        'acodec': acodec,
+        'height': fmt.get('height'),
+        'fps': fmt.get('fps'),
+        'abr': round(bitrate / 1000) if bitrate and vcodec == 'none' else None,
+        'filesize': int(content_length) if content_length and str(content_length).isdigit() else None,
+        'url': fmt.get('url'),
+    }
+
+
+def _fetch_basic_info(video_id, with_formats=False):
+    """通过youtube-search-python获取基本信息，并转换为yt-dlp字段名"""
+    video_url = f"https://www.youtube.com/watch?v={video_id}"
+    with request_slot():
+        Video = _lazy_import('youtubesearchpython').Video
+        basic = Video.get(video_url) if with_formats else Video.getInfo(video_url)
+    if not basic:
+        return None
+
+    seconds = (basic.get('duration') or {}).get('secondsText')
+    views = (basic.get('viewCount') or {}).get('text')
+    thumbnails = basic.get('thumbnails') or []
+    channel = basic.get('channel') or {}
+    info_dict = {
+        'title': basic.get('title'),
+        'duration': int(seconds) if seconds and str(seconds).isdigit() else None,
+        'view_count': int(views) if views and str(views).isdigit() else None,
+        'average_rating': basic.get('averageRating'),
+        'uploader': channel.get('name'),
+        'description': basic.get('description'),
+        'thumbnail': thumbnails[-1].get('url') if thumbnails else None,
+        'upload_date': (basic.get('uploadDate') or '').replace('-', '')[:8] or None,
+        'uploader_url': channel.get('link'),
+        'tags': basic.get('keywords') or [],
+    }
+
+    if with_formats:
+        streaming_data = basic.get('streamingData') or {}
+        info_dict['formats'] = [
+            _convert_basic_format(fmt)
+            for fmt in (streaming_data.get('formats') or []) + (streaming_data.get('adaptiveFormats') or [])
+        ]
+    return info_dict
+
+
+def _is_complete_info(info_dict):
+    """判断信息是否完整（有标题且至少有一个可直接下载的流）"""
+    return bool(info_dict and info_dict.get('title')
+                and any(fmt.get('url') for fmt in info_dict.get('formats') or []))
+
+
+def _resolve_info_dict(video_id, strategy):
+    """
+    按策略获取yt-dlp格式的信息字典
+    返回 (info_dict, 使用的来源, 各来源耗时毫秒)，全部失败时抛出yt-dlp的异常
+    """
+    timings = {}
+
+    def timed(source, fetch, *args):
+        start = time.time()
+        try:
+            return fetch(*args)
+        finally:
+            timings[source] = round((time.time() - start) * 1000)
+
+    if strategy == 'ytdlp':
+        return timed('ytdlp', _fetch_ytdlp_info, video_id), 'ytdlp', timings
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        # 复制上下文，子线程中的请求沿用调用方的限流优先级
+        ytdlp_future = executor.submit(contextvars.copy_context().run,
+                                       timed, 'ytdlp', _fetch_ytdlp_info, video_id)
+        basic_future = executor.submit(contextvars.copy_context().run,
+                                       timed, 'basic', _fetch_basic_info, video_id, strategy == 'race')
+
+        if strategy == 'race':
+            # 先完成且结果完整者胜出，未完成的一方不再等待
+            for future in as_completed([ytdlp_future, basic_future]):
+                if future is basic_future:
+                    if future.exception() is None and _is_complete_info(future.result()):
+                        return future.result(), 'basic', dict(timings)
+                elif future.exception() is None:
+                    return future.result(), 'ytdlp', dict(timings)
+            # 两者都没有可用结果，抛出yt-dlp的错误
+            return ytdlp_future.result(), 'ytdlp', dict(timings)
+
+        # merged：以yt-dlp结果为准，用基本信息补全缺失字段
+        info_dict = ytdlp_future.result()
+        try:
+            basic_info = basic_future.result()
+        except Exception:
+            basic_info = None
+        if basic_info:
+            for field in MERGEABLE_FIELDS:
+                if not info_dict.get(field) and basic_info.get(field):
+                    info_dict[field] = basic_info[field]
+        return info_dict, 'merged', dict(timings)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def get_video_info(url_or_id, use_cache=True, strategy=None):
+    """获取YouTube视频信息（优先读取磁盘缓存）"""
     try:
         video_id = extract_video_id(url_or_id)
         if not video_id:
@@ -58,52 +286,87 @@ def get_video_info(url_or_id):
                 'error_type': 'invalid_url'
             }
 
-        # 使用youtube-search-python获取基本信息（无API限制）
-        video_basic_info = None
-        try:
-            video_basic_info = Video.getInfo(f"https://www.youtube.com/watch?v={video_id}")
-        except Exception:
-            pass
-
-        # 使用yt-dlp获取详细信息和流
-        ydl_opts = {
-            'logger': YouTubeLogger(),
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-        }
-
-        # 检查cookies文件
-        cookies_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'cookies.txt')
-        if os.path.exists(cookies_path):
-            ydl_opts['cookiefile'] = cookies_path
+        cache = get_default_cache() if use_cache else None
+        cookie_id = get_cookie_identity(COOKIES_PATH)
+        if cache:
+            try:
+                cached_info = cache.get(video_id, cookie_id)
+                if cached_info:
+                    return cached_info
+            except Exception:
+                pass
+
+        strategy = strategy or DEFAULT_INFO_STRATEGY
+        if strategy not in INFO_STRATEGIES:
+            return {
+                'success': False,
+                'error': f'Unknown info strategy: {strategy}. Available strategies: {", ".join(INFO_STRATEGIES)}',
+                'error_type': 'invalid_strategy'
+            }
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        # 同一视频的并发请求合并为一次提取，失败结果短时间内直接复用
+        while True:
             try:
-                info_dict = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
-            except yt_dlp.utils.DownloadError as e:
-                error_msg = str(e)
-                if "429" in error_msg or "Too Many Requests" in error_msg:
-                    return {
-                        'success': False,
-                        'error': 'YouTube is rate limiting requests. Please try again later.',
-                        'error_type': 'rate_limited',
-                        'details': error_msg
-                    }
-                elif "Sign in to confirm" in error_msg:
+                return _info_flight.do(
+                    (video_id, cookie_id, strategy),
+                    lambda: _extract_video_info(video_id, strategy, cache, cookie_id)
+                )
+            except RateLimitBusy as e:
+                if current_priority() == PRIORITY_LOW:
                     return {
                         'success': False,
-                        'error': 'YouTube requires verification. This video may be restricted.',
-                        'error_type': 'verification_required',
-                        'details': error_msg
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'error': f'Failed to extract video info: {error_msg}',
-                        'error_type': 'extraction_failed',
-                        'details': error_msg
+                        'error': 'Prefetch yielded to foreground requests',
+                        'error_type': 'prefetch_cancelled',
+                        'details': str(e)
                     }
+                # 合并到的是被取消的预取，由当前请求重新提取
+
+    except Exception as e:
+        error_msg = str(e)
+        return {
+            'success': False,
+            'error': f'Unexpected error: {error_msg}',
+            'error_type': 'unknown',
+            'details': traceback.format_exc()
+        }
+
+
+def _extract_video_info(video_id, strategy, cache, cookie_id):
+    """提取并整理视频信息，成功时写入缓存"""
+    try:
+        # 按策略获取详细信息和流
+        try:
+            info_dict, source, timings = _resolve_info_dict(video_id, strategy)
+        except RateLimitTimeout as e:
+            return {
+                'success': False,
+                'error': 'YouTube is rate limiting requests. Please try again later.',
+                'error_type': 'rate_limited',
+                'details': str(e)
+            }
+        except _download_error() as e:
+            error_msg = str(e)
+            if "429" in error_msg or "Too Many Requests" in error_msg:
+                return {
+                    'success': False,
+                    'error': 'YouTube is rate limiting requests. Please try again later.',
+                    'error_type': 'rate_limited',
+                    'details': error_msg
+                }
+            elif "Sign in to confirm" in error_msg:
+                return {
+                    'success': False,
+                    'error': 'YouTube requires verification. This video may be restricted.',
+                    'error_type': 'verification_required',
+                    'details': error_msg
+                }
+            else:
+                return {
+                    'success': False,
+                    'error': f'Failed to extract video info: {error_msg}',
+                    'error_type': 'extraction_failed',
+                    'details': error_msg
+                }
 
         # 处理视频信息
         video_info = {
@@ -119,164 +382,558 @@ def get_video_info(url_or_id):
             'video_id': video_id,
             'channel_url': info_dict.get('uploader_url'),
             'keywords': info_dict.get('tags', [])[:10] if info_dict.get('tags') else [],
+            'source': source,
+            'timings': timings,
         }
 
-        # 处理格式信息
-        formats = info_dict.get('formats', [])
+        # 整理流信息（跳过没有地址的格式）
+        video_info.update(normalize_streams(
+            stream_from_ytdlp(fmt, include_url=True)
+            for fmt in info_dict.get('formats') or [] if fmt.get('url')
+        ))
+        # 缩略图换成本地代理地址
+        add_local_thumbnails([video_info], 'thumbnail_url')
 
-        # 过滤掉storyboard等无用格式
-        valid_formats = [f for f in formats if f.get('format_note') != 'storyboard']
+        if cache:
+            try:
+                cache.put(video_id, cookie_id, video_info)
+            except Exception:
+                pass
 
-        streams_data = []
-        audio_streams = []
-        video_streams = []
+        return video_info
+
+    except RateLimitBusy:
+        # 预取让出预算，不作为失败结果缓存
+        raise
+
+    except Exception as e:
+        error_msg = str(e)
+        return {
+            'success': False,
+            'error': f'Unexpected error: {error_msg}',
+            'error_type': 'unknown',
+            'details': traceback.format_exc()
+        }
 
-        for fmt in valid_formats:
-            if not fmt.get('url'):
-                continue
 
-            stream_info = {
-                'itag': fmt.get('format_id'),
-                'mime_type': fmt.get('ext'),
-                'type': 'video' if fmt.get('vcodec') != 'none' else 'audio',
-                'subtype': fmt.get('ext'),
-                'filesize': fmt.get('filesize') or fmt.get('filesize_approx', 0),
-                'filesize_mb': round((fmt.get('filesize') or fmt.get('filesize_approx', 0)) / 1024 / 1024, 2) if (fmt.get('filesize') or fmt.get('filesize_approx')) else 0,
-                'is_progressive': fmt.get('acodec') != 'none' and fmt.get('vcodec') != 'none',
-                'includes_audio_track': fmt.get('acodec') != 'none',
-                'includes_video_track': fmt.get('vcodec') != 'none',
-                'url': fmt.get('url'),  # 添加URL用于下载
+def get_video_info_batch(urls_or_ids, max_workers=4, item_callback=None):
+    """
+    批量获取视频信息
+    输入先按视频ID去重，再用有界线程池并发解析（共享同一个YoutubeDL实例），
+    每完成一个就通过item_callback按完成顺序返回
+    """
+    unique_ids = {}
+    invalid_inputs = []
+    duplicates = 0
+
+    for url_or_id in urls_or_ids:
+        url_or_id = url_or_id.strip()
+        if not url_or_id:
+            continue
+        video_id = extract_video_id(url_or_id)
+        if not video_id:
+            invalid_inputs.append(url_or_id)
+        elif video_id in unique_ids:
+            duplicates += 1
+        else:
+            unique_ids[video_id] = url_or_id
+
+    succeeded = 0
+    failed = 0
+
+    def report(item):
+        if item_callback:
+            item_callback(item)
+
+    for url_or_id in invalid_inputs:
+        failed += 1
+        report({
+            'type': 'item',
+            'input': url_or_id,
+            'video_id': None,
+            'result': {
+                'success': False,
+                'error': 'Invalid YouTube URL or video ID',
+                'error_type': 'invalid_url'
             }
+        })
 
-            # 视频流信息
-            if fmt.get('vcodec') != 'none':
-                stream_info.update({
-                    'resolution': f"{fmt.get('height', 0)}p" if fmt.get('height') else 'Unknown',
-                    'fps': fmt.get('fps'),
-                    'video_codec': fmt.get('vcodec'),
+    if unique_ids:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_ids))) as executor:
+            futures = {
+                executor.submit(get_video_info, video_id): video_id
+                for video_id in unique_ids
+            }
+            for future in as_completed(futures):
+                video_id = futures[future]
+                result = future.result()
+                if result.get('success'):
+                    succeeded += 1
+                else:
+                    failed += 1
+                report({
+                    'type': 'item',
+                    'input': unique_ids[video_id],
+                    'video_id': video_id,
+                    'result': result
                 })
-                video_streams.append(stream_info)
 
-            # 音频流信息
-            if fmt.get('acodec') != 'none' and fmt.get('vcodec') == 'none':
-                stream_info.update({
-                    'abr': f"{fmt.get('abr', 0)}kbps" if fmt.get('abr') else 'Unknown',
-                    'audio_codec': fmt.get('acodec'),
-                })
-                audio_streams.append(stream_info)
+    return {
+        'success': True,
+        'type': 'summary',
+        'total': len(unique_ids) + len(invalid_inputs),
+        'succeeded': succeeded,
+        'failed': failed,
+        'duplicates': duplicates
+    }
 
-            streams_data.append(stream_info)
 
-        # 按质量排序
-        video_streams.sort(key=lambda x: int(x['resolution'][:-1]) if x['resolution'] != 'Unknown' and x['resolution'][:-1].isdigit() else 0, reverse=True)
-        audio_streams.sort(key=lambda x: int(x['abr'][:-4]) if x['abr'] != 'Unknown' and x['abr'][:-4].isdigit() else 0, reverse=True)
+# 每页请求的结果上限（YouTube每页约20条，页内截断由search_videos处理）
+SEARCH_PAGE_LIMIT = 100
+# 单次调用最多请求的页数，避免空页时无限翻页
+MAX_SEARCH_PAGES = 10
 
-        video_info['streams'] = {
-            'all': streams_data,
-            'video_only': [s for s in video_streams if not s['includes_audio_track']],
-            'audio_only': audio_streams,
-            'progressive': [s for s in video_streams if s['is_progressive']],
-        }
 
-        # 推荐格式
-        recommended = []
-
-        # 推荐1：最佳progressive流
-        progressive_streams = [s for s in video_streams if s['is_progressive']]
-        if progressive_streams:
-            best_progressive = progressive_streams[0]
-            recommended.append({
-                'id': 'best_progressive',
-                'name': '推荐：最佳质量（音视频合并）',
-                'itag': best_progressive['itag'],
-                'description': f"{best_progressive['resolution']} {best_progressive['subtype']}格式",
-                'type': 'progressive'
-            })
+def _encode_search_token(state):
+    """把续页状态编码为base64url的JSON"""
+    raw = json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
 
-        # 推荐2：720p progressive
-        for stream in progressive_streams:
-            if stream['resolution'] == '720p':
-                recommended.append({
-                    'id': '720p_progressive',
-                    'name': '推荐：720p高清',
-                    'itag': stream['itag'],
-                    'description': f"720p {stream['subtype']}格式，兼容性好",
-                    'type': 'progressive'
-                })
+
+def _decode_search_token(token):
+    """解析续页令牌，无效时返回None"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        state = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(state, dict) or not state.get('q'):
+        return None
+    return state
+
+
+def _convert_search_result(video):
+    """把youtube-search-python的结果转换为接口格式"""
+    return {
+        'video_id': video.get('id'),
+        'title': video.get('title'),
+        'duration': video.get('duration'),
+        'views': video.get('viewCount', {}).get('text', '0'),
+        'author': video.get('channel', {}).get('name', 'Unknown'),
+        'thumbnail': video.get('thumbnails', [{}])[-1].get('url') if video.get('thumbnails') else None,
+        'url': video.get('link'),
+        'publish_time': video.get('publishedTime'),
+        'description': video.get('descriptionSnippet', [{}])[0].get('text', '') if video.get('descriptionSnippet') else ''
+    }
+
+
+def _fetch_search_page(query, continuation_key=None):
+    """
+    请求一页搜索结果，优先读取搜索缓存（按规范化的查询和续页键）
+    continuation_key为None时请求第一页，否则直接请求该续页（不重新请求之前的页）
+    返回 (该页结果, 下一页的continuation key, 是否来自缓存)
+    """
+    search_cache = get_default_search_cache()
+    if search_cache:
+        try:
+            cached_page = search_cache.get(query, continuation_key)
+            if cached_page:
+                return cached_page[0], cached_page[1], True
+        except Exception:
+            pass
+
+    search_module = _lazy_import('youtubesearchpython')
+    with request_slot():
+        if continuation_key is None:
+            search = search_module.VideosSearch(query, limit=SEARCH_PAGE_LIMIT)
+        else:
+            # 不经过VideosSearch.__init__（它会请求第一页），直接从续页状态开始
+            core = _lazy_import('youtubesearchpython.core.search')
+            constants = _lazy_import('youtubesearchpython.core.constants')
+            search = search_module.VideosSearch.__new__(search_module.VideosSearch)
+            search.searchMode = (True, False, False)
+            core.SearchCore.__init__(search, query, SEARCH_PAGE_LIMIT, 'en', 'US',
+                                     constants.SearchMode.videos, None)
+            search.continuationKey = continuation_key
+            search._next()
+
+    page = (search.result() or {}).get('result') or []
+    next_key = search.continuationKey
+    # 没有新的续页时结束
+    if next_key == continuation_key:
+        next_key = None
+
+    if search_cache:
+        try:
+            search_cache.put(query, continuation_key, page, next_key)
+        except Exception:
+            pass
+    return page, next_key, False
+
+
+def search_videos(query, max_results=20, item_callback=None, continuation_key=None, skip=0):
+    """
+    搜索YouTube视频，按页请求直到凑够max_results条
+    item_callback(video) 在每页解析完成后逐条调用，调用方可以先展示已到达的结果
+    返回结果中的continuation为续页令牌（没有更多结果时为None），交给search_next继续
+    """
+    try:
+        videos = []
+        from_cache = True
+        page_key = continuation_key
+        for page_number in range(1, MAX_SEARCH_PAGES + 1):
+            page, next_key, page_cached = _fetch_search_page(query, page_key)
+            from_cache = from_cache and page_cached
+            page = page[skip:]
+            taken = page[:max_results - len(videos)]
+            converted = add_local_thumbnails([_convert_search_result(video) for video in taken], 'thumbnail')
+            for video_info in converted:
+                videos.append(video_info)
+                if item_callback:
+                    item_callback(video_info)
+
+            if len(taken) < len(page):
+                # 本页还有剩余：令牌指向本页，并记录已跳过的条数
+                continuation = {'q': query, 'k': page_key, 's': skip + len(taken), 'n': max_results}
+                break
+            if not next_key:
+                continuation = None
+                break
+            skip = 0
+            page_key = next_key
+            if len(videos) >= max_results or page_number == MAX_SEARCH_PAGES:
+                continuation = {'q': query, 'k': page_key, 's': 0, 'n': max_results}
                 break
 
-        # 推荐3：最佳音频
-        if audio_streams:
-            best_audio = audio_streams[0]
-            recommended.append({
-                'id': 'best_audio',
-                'name': '推荐：最佳音质',
-                'itag': best_audio['itag'],
-                'description': f"{best_audio['abr']} {best_audio['subtype']}格式",
-                'type': 'audio'
-            })
+        if not videos and continuation_key is None:
+            return {
+                'success': False,
+                'error': 'No search results found',
+                'error_type': 'no_results'
+            }
 
-        video_info['recommended'] = recommended
+        return {
+            'success': True,
+            'results': videos,
+            'total': len(videos),
+            'continuation': _encode_search_token(continuation) if continuation else None,
+            'cached': from_cache
+        }
 
-        return video_info
+    except RateLimitTimeout as e:
+        return {
+            'success': False,
+            'error': 'YouTube is rate limiting requests. Please try again later.',
+            'error_type': 'rate_limited',
+            'details': str(e)
+        }
 
     except Exception as e:
         error_msg = str(e)
         return {
             'success': False,
-            'error': f'Unexpected error: {error_msg}',
-            'error_type': 'unknown',
+            'error': f'Search failed: {error_msg}',
+            'error_type': 'search_failed',
             'details': traceback.format_exc()
         }
 
 
-def search_videos(query, max_results=20):
-    """搜索YouTube视频"""
+def search_next(token, max_results=None, item_callback=None):
+    """根据续页令牌获取后续搜索结果"""
+    state = _decode_search_token(token)
+    if not state:
+        return {
+            'success': False,
+            'error': 'Invalid continuation token',
+            'error_type': 'invalid_token'
+        }
+    return search_videos(state['q'], max_results or state.get('n') or 20, item_callback,
+                         continuation_key=state.get('k'), skip=state.get('s') or 0)
+
+
+# 搜索后预取前K个结果的视频信息（常驻模式使用，设置为0关闭）
+PREFETCH_TOP_K = int(os.environ.get('YEWTUBE_PREFETCH_TOP_K', 3))
+
+_prefetch_executor = None
+_prefetch_lock = threading.Lock()
+_prefetch_generation = 0
+
+
+def prefetch_video_info(video_ids):
+    """
+    在后台以低优先级解析视频信息并写入缓存，用户点击搜索结果时可直接命中
+    - 新的预取批次会取消之前尚未开始的预取
+    - 预取的请求不排队，前台请求需要预算时立即让出，并放弃本批剩余的预取
+    - 前台请求与进行中的预取通过single flight合并
+    """
+    global _prefetch_executor, _prefetch_generation
+    if not video_ids or not get_default_cache():
+        return
+    with _prefetch_lock:
+        _prefetch_generation += 1
+        generation = _prefetch_generation
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        for video_id in video_ids:
+            _prefetch_executor.submit(_prefetch_one, video_id, generation)
+
+
+def _prefetch_one(video_id, generation):
+    global _prefetch_generation
+    if generation != _prefetch_generation:
+        return
+    with priority_scope(PRIORITY_LOW):
+        result = get_video_info(video_id)
+    if result.get('error_type') in ('prefetch_cancelled', 'rate_limited'):
+        with _prefetch_lock:
+            if _prefetch_generation == generation:
+                _prefetch_generation += 1
+
+
+def _prefetch_search_results(result, top_k):
+    """预取搜索结果中排在前面的视频"""
+    if top_k > 0 and result.get('success'):
+        prefetch_video_info([video['video_id'] for video in result['results'][:top_k] if video.get('video_id')])
+
+
+def _ranged_progress_callback(progress_callback):
+    """把分段下载器的进度转换为与yt-dlp进度钩子一致的格式"""
+    if not progress_callback:
+        return None
+
+    def callback(downloaded, total, speed):
+        eta = (total - downloaded) / speed if speed and total else None
+        progress_callback({
+            'type': 'progress',
+            'percentage': round(downloaded / total * 100, 1) if total else 0,
+            'speed': f"{speed / 1024 / 1024:.2f}MiB/s" if speed else 'Unknown',
+            'eta': f"{int(eta)}s" if eta is not None else 'Unknown',
+            'downloaded': downloaded,
+            'total': total
+        })
+
+    return callback
+
+
+def _can_download_ranged(info_dict, connections):
+    """单文件的http(s)格式可以用多连接分段下载，合并格式和分片格式交给yt-dlp"""
+    return (connections > 1
+            and not info_dict.get('requested_formats')
+            and info_dict.get('protocol') in ('http', 'https')
+            and info_dict.get('url'))
+
+
+# 自适应最佳质量：分别获取最佳纯视频流和纯音频流，边下载边用ffmpeg合并
+ADAPTIVE_FORMAT = 'best-adaptive'
+
+# 视频容器对应的首选音频格式，以及合并后的输出容器
+AUDIO_EXT_FOR_VIDEO = {'mp4': 'm4a', 'webm': 'webm'}
+MUX_CONTAINERS = {('mp4', 'm4a'): ('mp4', 'mp4'), ('webm', 'webm'): ('webm', 'webm')}
+
+
+def _select_adaptive_formats(formats, max_height=None):
+    """选择最佳的纯视频流和与之容器匹配的纯音频流（仅限可直接请求的http格式）"""
+    direct = [f for f in formats if f.get('url') and f.get('protocol') in ('http', 'https')]
+    videos = [f for f in direct
+              if f.get('vcodec') not in (None, 'none') and f.get('acodec') == 'none'
+              and (not max_height or (f.get('height') or 0) <= max_height)]
+    audios = [f for f in direct if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+    if not videos or not audios:
+        return None, None
+
+    video = max(videos, key=lambda f: (f.get('height') or 0, f.get('fps') or 0, f.get('tbr') or 0))
+    preferred_ext = AUDIO_EXT_FOR_VIDEO.get(video.get('ext'))
+    matching = [f for f in audios if f.get('ext') == preferred_ext] or audios
+    audio = max(matching, key=lambda f: f.get('abr') or f.get('tbr') or 0)
+    return video, audio
+
+
+def _stream_format(fmt, out_file, on_data):
+    """把一个格式的数据按顺序写入管道"""
+    total_size = fmt.get('filesize') or ranged_downloader.probe_size(fmt['url'], fmt.get('http_headers'))
+    if not total_size:
+        raise ranged_downloader.RangedDownloadError(f"Unknown size for format {fmt.get('format_id')}")
+    ranged_downloader.stream_ranges(fmt['url'], out_file, total_size, fmt.get('http_headers'), on_data=on_data)
+    return total_size
+
+
+def _mux_from_pipes(video, audio, output_path, container, on_data):
+    """视频和音频并发下载并通过管道直接送入ffmpeg合并，不落地临时文件"""
+    video_read, video_write = os.pipe()
+    audio_read, audio_write = os.pipe()
+    command = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', f'pipe:{video_read}', '-i', f'pipe:{audio_read}',
+        '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-f', container, output_path
+    ]
+    process = subprocess.Popen(command, pass_fds=(video_read, audio_read),
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    os.close(video_read)
+    os.close(audio_read)
+
+    errors = []
+
+    def feed(fmt, write_fd):
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe:
+                _stream_format(fmt, pipe, on_data)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=feed, args=(video, video_write), daemon=True),
+               threading.Thread(target=feed, args=(audio, audio_write), daemon=True)]
+    for thread in threads:
+        thread.start()
+    stderr = process.communicate()[1]
+    for thread in threads:
+        thread.join()
+
+    if process.returncode != 0:
+        raise ranged_downloader.RangedDownloadError(
+            f"ffmpeg failed: {stderr.decode('utf-8', 'replace').strip() or process.returncode}")
+    if errors:
+        raise ranged_downloader.RangedDownloadError(f'Stream download failed: {errors[0]}')
+
+
+def _mux_from_files(video, audio, output_path, container, on_data):
+    """不支持传递管道句柄的平台（Windows）：并发下载到临时文件后再合并"""
+    temp_paths = [f'{output_path}.f{video["format_id"]}', f'{output_path}.f{audio["format_id"]}']
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(ranged_downloader.download_file, fmt['url'], path,
+                                headers=fmt.get('http_headers'), expected_size=fmt.get('filesize'))
+                for fmt, path in zip((video, audio), temp_paths)
+            ]
+            for future in futures:
+                on_data(future.result()['filesize'])
+
+        result = subprocess.run([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-i', temp_paths[0], '-i', temp_paths[1],
+            '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-f', container, output_path
+        ], capture_output=True)
+        if result.returncode != 0:
+            raise ranged_downloader.RangedDownloadError(
+                f"ffmpeg failed: {result.stderr.decode('utf-8', 'replace').strip() or result.returncode}")
+    finally:
+        for path in temp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def download_best_adaptive(url_or_id, output_dir, max_height=None, progress_callback=None):
+    """下载最佳质量的自适应格式（1080p及以上只有分离的视频流和音频流）"""
     try:
-        videos_search = VideosSearch(query, limit=max_results)
-        results = videos_search.result()
+        video_id = extract_video_id(url_or_id)
+        if not video_id:
+            return {
+                'success': False,
+                'error': 'Invalid YouTube URL or video ID',
+                'error_type': 'invalid_url'
+            }
 
-        if not results or 'result' not in results:
+        if not shutil.which('ffmpeg'):
             return {
                 'success': False,
-                'error': 'No search results found',
-                'error_type': 'no_results'
+                'error': 'ffmpeg is required to merge adaptive video and audio streams',
+                'error_type': 'ffmpeg_unavailable'
             }
 
-        videos = []
-        for video in results['result']:
-            video_info = {
-                'video_id': video.get('id'),
-                'title': video.get('title'),
-                'duration': video.get('duration'),
-                'views': video.get('viewCount', {}).get('text', '0'),
-                'author': video.get('channel', {}).get('name', 'Unknown'),
-                'thumbnail': video.get('thumbnails', [{}])[-1].get('url') if video.get('thumbnails') else None,
-                'url': video.get('link'),
-                'publish_time': video.get('publishedTime'),
-                'description': video.get('descriptionSnippet', [{}])[0].get('text', '') if video.get('descriptionSnippet') else ''
+        os.makedirs(output_dir, exist_ok=True)
+
+        with request_slot():
+            info_dict = get_info_ydl().extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+        title = info_dict.get('title', 'Unknown')
+        video, audio = _select_adaptive_formats(info_dict.get('formats') or [], max_height)
+        if not video:
+            return {
+                'success': False,
+                'error': 'No adaptive video/audio streams available',
+                'error_type': 'stream_not_found'
             }
-            videos.append(video_info)
+
+        ext, container = MUX_CONTAINERS.get((video.get('ext'), audio.get('ext')), ('mkv', 'matroska'))
+        filename = f"{_lazy_import('yt_dlp.utils').sanitize_filename(title)}-{video_id}.{ext}"
+        file_path = os.path.join(output_dir, filename)
+        part_path = file_path + '.part'
+
+        total_size = (video.get('filesize') or 0) + (audio.get('filesize') or 0)
+        counter = ranged_downloader.ProgressCounter(total_size, _ranged_progress_callback(progress_callback))
+
+        if os.name == 'posix':
+            _mux_from_pipes(video, audio, part_path, container, counter.add)
+        else:
+            _mux_from_files(video, audio, part_path, container, counter.add)
+        os.replace(part_path, file_path)
+
+        if progress_callback:
+            progress_callback({
+                'type': 'complete',
+                'filename': file_path
+            })
 
         return {
             'success': True,
-            'results': videos,
-            'total': len(videos)
+            'title': title,
+            'filename': filename,
+            'file_path': file_path,
+            'filesize': os.path.getsize(file_path),
+            'video_format': video.get('format_id'),
+            'audio_format': audio.get('format_id'),
+            'resolution': f"{video.get('height')}p" if video.get('height') else 'Unknown'
+        }
+
+    except ranged_downloader.RangedDownloadError as e:
+        return {
+            'success': False,
+            'error': f'Download failed: {str(e)}',
+            'error_type': 'download_failed',
+            'details': str(e)
+        }
+
+    except RateLimitTimeout as e:
+        return {
+            'success': False,
+            'error': 'YouTube is rate limiting requests. Please try again later.',
+            'error_type': 'rate_limited',
+            'details': str(e)
+        }
+
+    except _download_error() as e:
+        error_msg = str(e)
+        if "429" in error_msg or "Too Many Requests" in error_msg:
+            return {
+                'success': False,
+                'error': 'YouTube is rate limiting requests. Please try again later.',
+                'error_type': 'rate_limited',
+                'details': error_msg
+            }
+        return {
+            'success': False,
+            'error': f'Download failed: {error_msg}',
+            'error_type': 'download_failed',
+            'details': error_msg
         }
 
     except Exception as e:
         error_msg = str(e)
         return {
             'success': False,
-            'error': f'Search failed: {error_msg}',
-            'error_type': 'search_failed',
+            'error': f'Unexpected error: {error_msg}',
+            'error_type': 'unknown',
             'details': traceback.format_exc()
         }
 
 
-def download_video(url_or_id, output_dir, format_id=None, audio_only=False, progress_callback=None):
-    """下载YouTube视频"""
+def download_video(url_or_id, output_dir, format_id=None, audio_only=False, progress_callback=None,
+                   connections=None, use_store=True):
+    """下载YouTube视频（默认经过共享下载存储，同一视频同一格式只下载一次）"""
     try:
+        if format_id == ADAPTIVE_FORMAT and not audio_only:
+            return download_best_adaptive(url_or_id, output_dir, progress_callback=progress_callback)
+
+        connections = connections or ranged_downloader.DEFAULT_CONNECTIONS
         video_id = extract_video_id(url_or_id)
         if not video_id:
             return {
@@ -288,29 +945,43 @@ def download_video(url_or_id, output_dir, format_id=None, audio_only=False, prog
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
 
+        # 格式选择和后处理选项
+        if audio_only:
+            format_selector = 'bestaudio/best'
+            store_options = {'extract_audio': 'mp3', 'quality': '192'}
+        else:
+            format_selector = format_id or 'best[height<=720]/best'
+            store_options = {}
+
+        # 使用共享存储时先下载到固定的暂存目录，完成后发布到存储再导出到输出目录
+        store = get_default_store() if use_store else None
+        if store:
+            download_dir = store.get_staging_dir(make_store_key('youtube', video_id, format_selector, store_options))
+        else:
+            download_dir = output_dir
+
         # 配置yt-dlp选项
         ydl_opts = {
             'logger': YouTubeLogger(),
-            'outtmpl': os.path.join(output_dir, '%(title)s-%(id)s.%(ext)s'),
+            'outtmpl': os.path.join(download_dir, '%(title)s-%(id)s.%(ext)s'),
+            'format': format_selector,
+            # DASH/HLS分片格式使用多个并发连接下载分片
+            'concurrent_fragment_downloads': connections,
+            # yt-dlp自行下载的格式保留.part文件，重试时续传
+            'continuedl': True,
         }
 
         # 检查cookies文件
-        cookies_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'cookies.txt')
-        if os.path.exists(cookies_path):
-            ydl_opts['cookiefile'] = cookies_path
+        if os.path.exists(COOKIES_PATH):
+            ydl_opts['cookiefile'] = COOKIES_PATH
 
-        # 根据参数设置格式
+        # 仅音频时转换为mp3
         if audio_only:
-            ydl_opts['format'] = 'bestaudio/best'
             ydl_opts['postprocessors'] = [{
                 'key': 'FFmpegExtractAudio',
                 'preferredcodec': 'mp3',
                 'preferredquality': '192',
             }]
-        elif format_id:
-            ydl_opts['format'] = format_id
-        else:
-            ydl_opts['format'] = 'best[height<=720]/best'
 
         # 进度回调
         if progress_callback:
@@ -332,30 +1003,98 @@ def download_video(url_or_id, output_dir, format_id=None, audio_only=False, prog
 
             ydl_opts['progress_hooks'] = [progress_hook]
 
-        # 执行下载
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # 先获取信息
-            info_dict = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
-            title = info_dict.get('title', 'Unknown')
+        # 记录后处理完成后的最终文件路径（如转换为mp3后的文件）
+        final_paths = []
 
-            # 执行下载
-            ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
+        def postprocessor_hook(d):
+            if d['status'] == 'finished' and d.get('info_dict', {}).get('filepath'):
+                final_paths.append(d['info_dict']['filepath'])
 
-            # 查找下载的文件
-            pattern = os.path.join(output_dir, f"*{video_id}*")
-            import glob
-            downloaded_files = glob.glob(pattern)
+        ydl_opts['postprocessor_hooks'] = [postprocessor_hook]
 
-            if downloaded_files:
-                filename = os.path.basename(downloaded_files[0])
-                filesize = os.path.getsize(downloaded_files[0])
+        # 执行下载
+        with _new_youtube_dl(ydl_opts) as ydl:
+            # 只提取一次信息，再用提取结果直接下载，避免yt-dlp重复解析页面和播放器
+            watch_url = f"https://www.youtube.com/watch?v={video_id}"
+            with request_slot():
+                info_dict = ydl.extract_info(watch_url, download=False)
+            title = info_dict.get('title', 'Unknown')
+
+            def produce():
+                nonlocal info_dict
+                if not audio_only and _can_download_ranged(info_dict, connections):
+                    def resolve_url():
+                        # 签名地址过期时重新解析，取同一格式的新地址；缓存的视频信息中的流地址同样已失效
+                        info_cache = get_default_cache()
+                        if info_cache:
+                            try:
+                                info_cache.invalidate(video_id)
+                            except Exception:
+                                pass
+                        with request_slot():
+                            fresh_info = ydl.extract_info(watch_url, download=False)
+                        for fmt in fresh_info.get('formats') or []:
+                            if fmt.get('format_id') == info_dict.get('format_id'):
+                                return fmt.get('url')
+                        return None
+
+                    # 单文件格式：按字节范围多连接下载到固定的.part文件（中断后可续传），完成后再原子地改名
+                    file_path = ydl.prepare_filename(info_dict)
+                    part_path = file_path + '.part'
+                    ranged_downloader.download_file(
+                        info_dict['url'], part_path, connections,
+                        headers=info_dict.get('http_headers'),
+                        expected_size=info_dict.get('filesize'),
+                        progress_callback=_ranged_progress_callback(progress_callback),
+                        resolve_url=resolve_url
+                    )
+                    os.replace(part_path, file_path)
+                    if progress_callback:
+                        progress_callback({
+                            'type': 'complete',
+                            'filename': file_path
+                        })
+                else:
+                    info_dict = ydl.process_ie_result(info_dict, download=True)
+
+                    # 从下载结果中获取最终文件路径，无需扫描输出目录
+                    requested_downloads = info_dict.get('requested_downloads') or []
+                    if requested_downloads and requested_downloads[-1].get('filepath'):
+                        file_path = requested_downloads[-1]['filepath']
+                    elif final_paths:
+                        file_path = final_paths[-1]
+                    else:
+                        file_path = ydl.prepare_filename(info_dict)
+                return file_path
+
+            cached = False
+            store_lease = None
+            if store:
+                # 本次导出的租约，调用方用完文件后释放；导出的文件名唯一，多个请求互不影响
+                store_lease = uuid.uuid4().hex
+                store_key = make_store_key('youtube', video_id, info_dict.get('format_id'), store_options)
+                entry, cached = store.fetch(store_key, produce, meta={'video_id': video_id, 'title': title},
+                                            lease=store_lease)
+                store.discard_staging_dir(download_dir)
+                file_path = store.export(entry, output_dir)
+                if cached and progress_callback:
+                    progress_callback({
+                        'type': 'complete',
+                        'filename': file_path
+                    })
+            else:
+                file_path = produce()
 
+            if file_path and os.path.exists(file_path):
                 return {
                     'success': True,
                     'title': title,
-                    'filename': filename,
-                    'file_path': downloaded_files[0],
-                    'filesize': filesize
+                    'filename': os.path.basename(file_path),
+                    'file_path': file_path,
+                    'filesize': os.path.getsize(file_path),
+                    'cached': cached,
+                    # 使用共享存储时，调用方用完文件后需要释放该租约（download_store.py release <lease>）
+                    'store_lease': store_lease
                 }
             else:
                 return {
@@ -364,7 +1103,23 @@ def download_video(url_or_id, output_dir, format_id=None, audio_only=False, prog
                     'error_type': 'file_not_found'
                 }
 
-    except yt_dlp.utils.DownloadError as e:
+    except ranged_downloader.RangedDownloadError as e:
+        return {
+            'success': False,
+            'error': f'Download failed: {str(e)}',
+            'error_type': 'download_failed',
+            'details': str(e)
+        }
+
+    except RateLimitTimeout as e:
+        return {
+            'success': False,
+            'error': 'YouTube is rate limiting requests. Please try again later.',
+            'error_type': 'rate_limited',
+            'details': str(e)
+        }
+
+    except _download_error() as e:
         error_msg = str(e)
 
         if "429" in error_msg or "Too Many Requests" in error_msg:
@@ -392,66 +1147,345 @@ def download_video(url_or_id, output_dir, format_id=None, audio_only=False, prog
         }
 
 
+def _serve_info(args, progress_callback):
+    """常驻模式：info命令"""
+    if len(args) not in (1, 2):
+        return {
+            'success': False,
+            'error': 'Usage: {"cmd": "info", "args": [<youtube_url_or_id>, <strategy>]}'
+        }
+    return get_video_info(args[0], strategy=args[1] if len(args) > 1 else None)
+
+
+def _serve_search(args, progress_callback):
+    """常驻模式：search命令"""
+    if not args:
+        return {
+            'success': False,
+            'error': 'Usage: {"cmd": "search", "args": [<query>, <max_results>]}'
+        }
+    max_results = int(args[1]) if len(args) > 1 and str(args[1]).isdigit() else 20
+    result = search_videos(args[0], max_results, _search_item_callback(progress_callback))
+    _prefetch_search_results(result, PREFETCH_TOP_K)
+    return result
+
+
+def _serve_search_next(args, progress_callback):
+    """常驻模式：search-next命令"""
+    if len(args) not in (1, 2):
+        return {
+            'success': False,
+            'error': 'Usage: {"cmd": "search-next", "args": [<continuation>, <max_results>]}'
+        }
+    max_results = int(args[1]) if len(args) > 1 and str(args[1]).isdigit() else None
+    result = search_next(args[0], max_results, _search_item_callback(progress_callback))
+    _prefetch_search_results(result, PREFETCH_TOP_K)
+    return result
+
+
+def _search_item_callback(progress_callback):
+    """每页解析完成后把搜索结果逐条作为item事件发出"""
+    def callback(video):
+        progress_callback({'type': 'item', 'video': video})
+    return callback
+
+
+def _serve_download(args, progress_callback):
+    """常驻模式：download命令（参数与命令行一致）"""
+    if len(args) < 2:
+        return {
+            'success': False,
+            'error': 'Usage: {"cmd": "download", "args": [<youtube_url_or_id>, <output_dir>, <format_id>, "audio"]}'
+        }
+    format_id = args[2] if len(args) > 2 and args[2] != 'audio' else None
+    audio_only = len(args) > 2 and 'audio' in args[2:]
+    return download_video(args[0], args[1], format_id, audio_only, progress_callback)
+
+
+def _serve_info_batch(args, progress_callback):
+    """常驻模式：info-batch命令，每个结果作为进度事件返回"""
+    if not args:
+        return {
+            'success': False,
+            'error': 'Usage: {"cmd": "info-batch", "args": [<youtube_url_or_id>, ...]}'
+        }
+    return get_video_info_batch(args, item_callback=progress_callback)
+
+
+def _serve_thumbnail(args, progress_callback):
+    """获取缩略图（Node未命中缓存、缓存过期或需要缩放时调用），返回本地文件路径"""
+    if len(args) not in (1, 2):
+        return {
+            'success': False,
+            'error': 'thumbnail requires a key and an optional width',
+            'error_type': 'invalid_request'
+        }
+    cache = get_default_thumbnail_cache()
+    if not cache:
+        return {
+            'success': False,
+            'error': 'Thumbnail proxy is disabled',
+            'error_type': 'thumbnail_failed'
+        }
+    try:
+        result = {'success': True}
+        result.update(cache.fetch(args[0], int(args[1]) if len(args) == 2 else 320))
+        return result
+    except (ThumbnailError, ValueError) as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'error_type': 'thumbnail_failed'
+        }
+
+
+SERVE_COMMANDS = {
+    'info': _serve_info,
+    'info-batch': _serve_info_batch,
+    'search': _serve_search,
+    'search-next': _serve_search_next,
+    'download': _serve_download,
+    'thumbnail': _serve_thumbnail,
+}
+
+
+def serve(max_workers=4, input_stream=None, output_stream=None):
+    """
+    常驻工作进程模式
+    每行读取一个JSON请求：{"id": ..., "cmd": "info", "args": [...]}
+    响应和进度事件按行输出，并带上请求id以便调用方复用同一进程并发请求
+    """
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+
+    # 协议独占stdout，其它库的意外输出重定向到stderr
+    sys.stdout = sys.stderr
+
+    write_lock = threading.Lock()
+
+    def emit(message):
+        line = json.dumps(message, ensure_ascii=False)
+        with write_lock:
+            output_stream.write(line + '\n')
+            output_stream.flush()
+
+    def run_request(request_id, handler, args):
+        def progress_callback(data):
+            event = dict(data)
+            event['event'] = event.pop('type', 'progress')
+            event.update({'id': request_id, 'type': 'progress'})
+            emit(event)
+
+        try:
+            result = handler(args, progress_callback)
+        except Exception as e:
+            result = {
+                'success': False,
+                'error': f'Unexpected error: {str(e)}',
+                'error_type': 'unknown',
+                'details': traceback.format_exc()
+            }
+        emit({'id': request_id, 'type': 'result', 'result': result})
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    emit({'id': None, 'type': 'ready', 'pid': os.getpid(), 'commands': sorted(SERVE_COMMANDS)})
+
+    try:
+        for line in input_stream:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('request must be a JSON object')
+            except ValueError as e:
+                emit({'id': None, 'type': 'result', 'result': {
+                    'success': False,
+                    'error': f'Invalid request: {str(e)}',
+                    'error_type': 'invalid_request'
+                }})
+                continue
+
+            request_id = request.get('id')
+            command = request.get('cmd')
+            args = request.get('args') or []
+
+            if command == 'shutdown':
+                break
+            if command == 'ping':
+                emit({'id': request_id, 'type': 'result', 'result': {'success': True, 'pid': os.getpid()}})
+                continue
+
+            handler = SERVE_COMMANDS.get(command)
+            if handler is None:
+                emit({'id': request_id, 'type': 'result', 'result': {
+                    'success': False,
+                    'error': f'Unknown command: {command}. Available commands: {", ".join(sorted(SERVE_COMMANDS))}',
+                    'error_type': 'invalid_request'
+                }})
+                continue
+            if not isinstance(args, list):
+                emit({'id': request_id, 'type': 'result', 'result': {
+                    'success': False,
+                    'error': 'args must be a list',
+                    'error_type': 'invalid_request'
+                }})
+                continue
+
+            executor.submit(run_request, request_id, handler, args)
+    finally:
+        # 等待进行中的请求完成后再退出
+        executor.shutdown(wait=True)
+
+
+def _report_startup_profile():
+    """把各模块的导入耗时输出到stderr（--startup-profile）"""
+    print(json.dumps({
+        'type': 'startup_profile',
+        'imports_ms': _import_timings,
+        'total_import_ms': round(sum(_import_timings.values()), 1),
+        'elapsed_ms': round((time.perf_counter() - _module_loaded_at) * 1000, 1)
+    }), file=sys.stderr, flush=True)
+
+
 def main():
     """主函数 - 命令行接口"""
-    if len(sys.argv) < 2:
+    try:
+        output_format, args = pop_format_arg(sys.argv[1:])
+    except OutputFormatError as e:
+        print(json.dumps({
+            'success': False,
+            'error': str(e),
+            'error_type': 'invalid_format'
+        }))
+        sys.exit(1)
+    if '--startup-profile' in args:
+        args.remove('--startup-profile')
+        atexit.register(_report_startup_profile)
+    # --prefetch=K：搜索结果输出后继续预取前K个视频的信息再退出
+    prefetch_top_k = 0
+    for arg in list(args):
+        if arg.startswith('--prefetch='):
+            value = arg.split('=', 1)[1]
+            prefetch_top_k = int(value) if value.isdigit() else 0
+            args.remove(arg)
+    argv = [sys.argv[0]] + args
+
+    if len(argv) < 2:
         print(json.dumps({
             'success': False,
             'error': 'Usage: python yewtube_service.py <command> [args...]'
         }))
         sys.exit(1)
 
-    command = sys.argv[1]
+    command = argv[1]
+
+    # ndjson输出时，搜索结果在每页解析完成后逐条输出，最后输出汇总
+    item_writer = None
+    if output_format == 'ndjson':
+        def item_writer(data):
+            write_result(data, output_format, line=True)
 
     if command == 'info':
-        if len(sys.argv) != 3:
+        if len(argv) != 3:
             print(json.dumps({
                 'success': False,
                 'error': 'Usage: python yewtube_service.py info <youtube_url_or_id>'
             }))
             sys.exit(1)
 
-        url_or_id = sys.argv[2]
+        url_or_id = argv[2]
         result = get_video_info(url_or_id)
-        print(json.dumps(result, ensure_ascii=False, indent=2))
+        write_result(result, output_format)
+
+    elif command == 'info-batch':
+        # 参数为空或为"-"时从stdin按行读取
+        items = argv[2:]
+        max_workers = int(os.environ.get('YEWTUBE_BATCH_WORKERS', '4'))
+        if items and items[0].startswith('--workers='):
+            value = items[0].split('=', 1)[1]
+            max_workers = int(value) if value.isdigit() else 0
+            items = items[1:]
+        if max_workers < 1:
+            print(json.dumps({
+                'success': False,
+                'error': 'Usage: python yewtube_service.py info-batch [--workers=N] <youtube_url_or_id>... (or "-" to read stdin)'
+            }))
+            sys.exit(1)
+        if not items or items == ['-']:
+            items = sys.stdin.read().split()
+
+        def item_callback(item):
+            write_result(item, output_format, line=True)
+
+        result = get_video_info_batch(items, max_workers, item_callback)
+        write_result(result, output_format, line=True)
 
     elif command == 'search':
-        if len(sys.argv) < 3:
+        if len(argv) < 3:
             print(json.dumps({
                 'success': False,
                 'error': 'Usage: python yewtube_service.py search <query> [max_results]'
             }))
             sys.exit(1)
 
-        query = ' '.join(sys.argv[2:-1]) if len(sys.argv) > 3 else sys.argv[2]
-        max_results = int(sys.argv[-1]) if len(sys.argv) > 3 and sys.argv[-1].isdigit() else 20
+        query = ' '.join(argv[2:-1]) if len(argv) > 3 else argv[2]
+        max_results = int(argv[-1]) if len(argv) > 3 and argv[-1].isdigit() else 20
 
-        result = search_videos(query, max_results)
-        print(json.dumps(result, ensure_ascii=False, indent=2))
+        result = search_videos(query, max_results, _search_item_callback(item_writer) if item_writer else None)
+        write_result(result, output_format)
+        _prefetch_search_results(result, prefetch_top_k)
+
+    elif command == 'search-next':
+        if len(argv) not in (3, 4):
+            print(json.dumps({
+                'success': False,
+                'error': 'Usage: python yewtube_service.py search-next <continuation> [max_results]'
+            }))
+            sys.exit(1)
+
+        max_results = int(argv[3]) if len(argv) > 3 and argv[3].isdigit() else None
+        result = search_next(argv[2], max_results, _search_item_callback(item_writer) if item_writer else None)
+        write_result(result, output_format)
+        _prefetch_search_results(result, prefetch_top_k)
 
     elif command == 'download':
-        if len(sys.argv) < 4:
+        if len(argv) < 4:
             print(json.dumps({
                 'success': False,
                 'error': 'Usage: python yewtube_service.py download <youtube_url_or_id> <output_dir> [format_id] [audio_only]'
             }))
             sys.exit(1)
 
-        url_or_id = sys.argv[2]
-        output_dir = sys.argv[3]
-        format_id = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] != 'audio' else None
-        audio_only = len(sys.argv) > 4 and 'audio' in sys.argv[4:]
+        url_or_id = argv[2]
+        output_dir = argv[3]
+        format_id = argv[4] if len(argv) > 4 and argv[4] != 'audio' else None
+        audio_only = len(argv) > 4 and 'audio' in argv[4:]
 
         def progress_callback(data):
-            print(json.dumps(data), flush=True)
+            write_result(data, output_format, line=True)
 
         result = download_video(url_or_id, output_dir, format_id, audio_only, progress_callback)
-        print(json.dumps(result, ensure_ascii=False, indent=2))
+        write_result(result, output_format)
+
+    elif command == 'serve':
+        default_workers = os.environ.get('YEWTUBE_SERVE_WORKERS', '4')
+        max_workers = argv[2] if len(argv) > 2 else default_workers
+        if not max_workers.isdigit() or int(max_workers) < 1:
+            print(json.dumps({
+                'success': False,
+                'error': 'Usage: python yewtube_service.py serve [max_workers]'
+            }))
+            sys.exit(1)
+
+        serve(int(max_workers))
 
     else:
         print(json.dumps({
             'success': False,
-            'error': f'Unknown command: {command}. Available commands: info, search, download'
+            'error': f'Unknown command: {command}. Available commands: info, info-batch, search, search-next, download, serve'
         }))
         sys.exit(1)
 
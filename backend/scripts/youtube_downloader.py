@@ -9,7 +9,8 @@ import json
 import os
 import time
 import traceback
-from pytube import YouTube
+import uuid
+from pytube import YouTube, extract
 from pytube.exceptions import (
     VideoUnavailable, 
     AgeRestrictedError, 
@@ -21,6 +22,9 @@ from pytube.exceptions import (
     PytubeError
 )
 
+import ranged_downloader
+from download_store import DownloadStoreError, get_default_store, make_store_key
+
 class ProgressTracker:
     """下载进度追踪器"""
     
@@ -31,7 +35,15 @@ class ProgressTracker:
     def on_progress(self, stream, chunk, bytes_remaining):
         """进度回调函数"""
         total_size = stream.filesize
-        bytes_downloaded = total_size - bytes_remaining
+        self.report(total_size - bytes_remaining, total_size)
+
+    def on_ranged_progress(self, bytes_downloaded, total_size, speed):
+        """分段下载器的进度回调"""
+        self.report(bytes_downloaded, total_size)
+
+    def report(self, bytes_downloaded, total_size):
+        """输出下载进度"""
+        bytes_remaining = total_size - bytes_downloaded
         percentage = (bytes_downloaded / total_size) * 100
         
         # 计算下载速度
@@ -73,58 +85,115 @@ class ProgressTracker:
             minutes = int((seconds % 3600) // 60)
             return f"{hours}小时{minutes}分钟"
 
-def download_video(url, itag, output_path, filename_prefix="youtube"):
+def download_video(url, itag, output_path, filename_prefix="youtube", connections=None):
     """下载YouTube视频"""
     try:
+        connections = connections or ranged_downloader.DEFAULT_CONNECTIONS
+
         # 创建进度追踪器
         progress_tracker = ProgressTracker()
         
-        # 创建YouTube对象
-        yt = YouTube(url, on_progress_callback=progress_tracker.on_progress)
-        
-        # 获取指定的流
-        stream = yt.streams.get_by_itag(int(itag))
-        if not stream:
-            return {
-                'success': False,
-                'error': f'Stream with itag {itag} not found',
-                'error_type': 'stream_not_found'
-            }
-        
         # 确保输出目录存在
         os.makedirs(output_path, exist_ok=True)
         
-        # 生成文件名
-        safe_title = "".join(c for c in yt.title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        safe_title = safe_title[:50]  # 限制文件名长度
+        # 视频ID直接从链接中解析，共享存储命中时无需访问YouTube
+        video_id = extract.video_id(url)
+        store = get_default_store()
+        store_key = make_store_key('youtube', video_id, itag)
+        # 本次导出的租约，调用方用完文件后释放
+        store_lease = uuid.uuid4().hex if store else None
+        entry = store.lookup(store_key, store_lease) if store else None
+        download_result = {'resumed_bytes': 0}
         
-        timestamp = int(time.time())
-        filename = f"{filename_prefix}_{timestamp}_{safe_title}.{stream.subtype}"
-        
-        # 发送开始下载信号
-        start_info = {
-            'type': 'start',
-            'title': yt.title,
-            'filename': filename,
-            'filesize': stream.filesize,
-            'filesize_mb': round(stream.filesize / 1024 / 1024, 2) if stream.filesize else 0
-        }
-        print(json.dumps(start_info), flush=True)
+        if entry:
+            title = entry['meta'].get('title', '')
+            filename = entry['filename']
+            cached = True
+            print(json.dumps({
+                'type': 'start',
+                'title': title,
+                'filename': filename,
+                'filesize': entry['size'],
+                'filesize_mb': round(entry['size'] / 1024 / 1024, 2)
+            }), flush=True)
+        else:
+            # 创建YouTube对象
+            yt = YouTube(url, on_progress_callback=progress_tracker.on_progress)
+            title = yt.title
+            
+            # 获取指定的流
+            stream = yt.streams.get_by_itag(int(itag))
+            if not stream:
+                return {
+                    'success': False,
+                    'error': f'Stream with itag {itag} not found',
+                    'error_type': 'stream_not_found'
+                }
+            
+            # 生成文件名
+            safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+            safe_title = safe_title[:50]  # 限制文件名长度
+            
+            # 下载用的文件名不含时间戳，重试时可以找到上次未完成的部分文件继续下载
+            filename = f"{filename_prefix}_{video_id}_{itag}_{safe_title}.{stream.subtype}"
+            
+            # 使用共享下载存储时在固定的暂存目录下载，完成后发布到存储再导出到输出目录
+            download_dir = store.get_staging_dir(store_key) if store else output_path
+            
+            # 发送开始下载信号
+            start_info = {
+                'type': 'start',
+                'title': title,
+                'filename': filename,
+                'filesize': stream.filesize,
+                'filesize_mb': round(stream.filesize / 1024 / 1024, 2) if stream.filesize else 0
+            }
+            print(json.dumps(start_info), flush=True)
+            
+            def resolve_url():
+                # 签名地址过期时重新获取同一itag的流地址
+                fresh_stream = YouTube(url).streams.get_by_itag(int(itag))
+                return fresh_stream.url if fresh_stream else None
+            
+            def produce():
+                # 多连接分段下载，已完成的范围记录在日志中，中断后重试只下载剩余部分
+                downloaded_path = os.path.join(download_dir, filename)
+                part_path = downloaded_path + '.part'
+                download_result.update(ranged_downloader.download_file(
+                    stream.url,
+                    part_path,
+                    connections,
+                    expected_size=stream.filesize,
+                    progress_callback=progress_tracker.on_ranged_progress,
+                    resolve_url=resolve_url
+                ))
+                os.replace(part_path, downloaded_path)
+                return downloaded_path
+            
+            cached = False
+            if store:
+                entry, cached = store.fetch(store_key, produce, meta={'video_id': video_id, 'title': title},
+                                            lease=store_lease)
+                store.discard_staging_dir(download_dir)
         
-        # 下载文件
-        file_path = stream.download(
-            output_path=output_path,
-            filename=filename
-        )
+        if store:
+            # 每次导出使用唯一的文件名，多个用户下载同一格式时互不影响
+            file_path = store.export(entry, output_path, filename)
+        else:
+            file_path = produce()
         
         # 发送完成信号
         complete_info = {
             'type': 'complete',
             'success': True,
             'file_path': file_path,
-            'filename': filename,
-            'title': yt.title,
+            'filename': os.path.basename(file_path),
+            'title': title,
             'filesize': os.path.getsize(file_path),
+            'resumed_bytes': download_result['resumed_bytes'],
+            'cached': cached,
+            # 使用共享存储时，调用方用完文件后需要释放该租约（download_store.py release <lease>）
+            'store_lease': store_lease,
             'download_time': time.time() - progress_tracker.start_time
         }
         print(json.dumps(complete_info), flush=True)
@@ -190,6 +259,16 @@ def download_video(url, itag, output_path, filename_prefix="youtube"):
         }
         print(json.dumps(error_info), flush=True)
         return error_info
+
+    except (ranged_downloader.RangedDownloadError, DownloadStoreError) as e:
+        error_info = {
+            'success': False,
+            'error': f'Download failed: {str(e)}',
+            'error_type': 'download_failed',
+            'details': str(e)
+        }
+        print(json.dumps(error_info), flush=True)
+        return error_info
         
     except Exception as e:
         error_info = {
@@ -203,10 +282,10 @@ def download_video(url, itag, output_path, filename_prefix="youtube"):
 
 def main():
     """主函数"""
-    if len(sys.argv) != 4:
+    if len(sys.argv) not in (4, 5) or (len(sys.argv) == 5 and not sys.argv[4].isdigit()):
         error_info = {
             'success': False,
-            'error': 'Usage: python youtube_downloader.py <youtube_url> <itag> <output_path>'
+            'error': 'Usage: python youtube_downloader.py <youtube_url> <itag> <output_path> [connections]'
         }
         print(json.dumps(error_info))
         sys.exit(1)
@@ -214,8 +293,9 @@ def main():
     url = sys.argv[1]
     itag = sys.argv[2]
     output_path = sys.argv[3]
+    connections = int(sys.argv[4]) if len(sys.argv) == 5 else None
     
-    result = download_video(url, itag, output_path)
+    result = download_video(url, itag, output_path, connections=connections)
     
     # 如果下载失败，确保返回错误信息
     if not result.get('success'):
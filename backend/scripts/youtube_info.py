@@ -20,6 +20,9 @@ from pytube.exceptions import (
     PytubeError
 )
 
+from output_format import OutputFormatError, pop_format_arg, write_result
+from stream_normalizer import normalize_streams, stream_from_pytube
+
 def get_video_info(url):
     """获取YouTube视频信息"""
     try:
@@ -52,86 +55,8 @@ def get_video_info(url):
             'keywords': yt.keywords[:10] if yt.keywords else [],  # 限制关键词数量
         }
 
-        # 获取流信息
-        streams_data = []
-        audio_streams = []
-        video_streams = []
-
-        for stream in yt.streams:
-            stream_info = {
-                'itag': stream.itag,
-                'mime_type': stream.mime_type,
-                'type': stream.type,
-                'subtype': stream.subtype,
-                'filesize': stream.filesize,
-                'filesize_mb': round(stream.filesize / 1024 / 1024, 2) if stream.filesize else 0,
-                'is_progressive': not stream.is_adaptive,
-                'includes_audio_track': stream.includes_audio_track,
-                'includes_video_track': stream.includes_video_track,
-            }
-
-            # 视频流信息
-            if stream.includes_video_track:
-                stream_info.update({
-                    'resolution': stream.resolution,
-                    'fps': getattr(stream, 'fps', None),
-                    'video_codec': getattr(stream, 'video_codec', None),
-                })
-                video_streams.append(stream_info)
-
-            # 音频流信息
-            if stream.includes_audio_track and not stream.includes_video_track:
-                stream_info.update({
-                    'abr': getattr(stream, 'abr', None),
-                    'audio_codec': getattr(stream, 'audio_codec', None),
-                })
-                audio_streams.append(stream_info)
-
-            streams_data.append(stream_info)
-
-        # 按质量排序
-        video_streams.sort(key=lambda x: int(x['resolution'][:-1]) if x['resolution'] else 0, reverse=True)
-        audio_streams.sort(key=lambda x: int(x['abr'][:-4]) if x['abr'] else 0, reverse=True)
-
-        video_info['streams'] = {
-            'all': streams_data,
-            'video_only': [s for s in video_streams if not s['includes_audio_track']],
-            'audio_only': audio_streams,
-            'progressive': [s for s in video_streams if s['is_progressive']],
-        }
-
-        # 推荐格式
-        recommended = []
-
-        # 推荐1：最佳progressive流（音视频合并）
-        best_progressive = None
-        for stream in video_streams:
-            if stream['is_progressive'] and stream['resolution']:
-                best_progressive = stream
-                break
-
-        if best_progressive:
-            recommended.append({
-                'id': 'best_progressive',
-                'name': '推荐：最佳质量（音视频合并）',
-                'itag': best_progressive['itag'],
-                'description': f"{best_progressive['resolution']} {best_progressive['subtype']}格式",
-                'type': 'progressive'
-            })
-
-        # 推荐2：720p progressive（如果有）
-        for stream in video_streams:
-            if stream['is_progressive'] and stream['resolution'] == '720p':
-                recommended.append({
-                    'id': '720p_progressive',
-                    'name': '推荐：720p高清',
-                    'itag': stream['itag'],
-                    'description': f"720p {stream['subtype']}格式，兼容性好",
-                    'type': 'progressive'
-                })
-                break
-
-        video_info['recommended'] = recommended
+        # 整理流信息
+        video_info.update(normalize_streams(stream_from_pytube(stream) for stream in yt.streams))
 
         return video_info
 
@@ -201,16 +126,26 @@ def get_video_info(url):
 
 def main():
     """主函数"""
-    if len(sys.argv) != 2:
+    try:
+        output_format, args = pop_format_arg(sys.argv[1:])
+    except OutputFormatError as e:
+        print(json.dumps({
+            'success': False,
+            'error': str(e),
+            'error_type': 'invalid_format'
+        }))
+        sys.exit(1)
+
+    if len(args) != 1:
         print(json.dumps({
             'success': False,
-            'error': 'Usage: python youtube_info.py <youtube_url>'
+            'error': 'Usage: python youtube_info.py [--format=json|compact-json|ndjson|msgpack] <youtube_url>'
         }))
         sys.exit(1)
 
-    url = sys.argv[1]
+    url = args[0]
     result = get_video_info(url)
-    print(json.dumps(result, ensure_ascii=False, indent=2))
+    write_result(result, output_format)
 
 if __name__ == '__main__':
     main()
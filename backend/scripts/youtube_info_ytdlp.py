@@ -2,23 +2,209 @@
 """
 使用yt-dlp和cookies获取YouTube视频信息
 这是pytube的替代方案，支持cookies认证
+默认在当前进程中调用yt-dlp库；设置YTDLP_SUBPROCESS=1或传入--subprocess时改为调用yt-dlp命令行
 """
 
 import sys
 import json
 import os
 import subprocess
+import tempfile
+import threading
 import traceback
+from functools import lru_cache
+from importlib.util import find_spec
 from pathlib import Path
 
-def get_video_info_with_ytdlp(url):
+from output_format import OutputFormatError, pop_format_arg, write_result
+from rate_limiter import RateLimitTimeout, get_default_limiter
+from stream_normalizer import normalize_streams, stream_from_ytdlp
+
+COOKIES_PATH = Path(__file__).parent.parent / 'config' / 'cookies.txt'
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+USE_SUBPROCESS = os.environ.get('YTDLP_SUBPROCESS', '0') == '1'
+SUBPROCESS_TIMEOUT = 60
+
+# 命令行模式下让yt-dlp只输出这些字段
+INFO_FIELDS = ('id', 'title', 'duration', 'view_count', 'average_rating', 'uploader', 'description',
+               'thumbnail', 'upload_date', 'uploader_url', 'tags')
+FORMAT_FIELDS = ('format_id', 'ext', 'vcodec', 'acodec', 'filesize', 'filesize_approx', 'height', 'fps', 'abr')
+INFO_TEMPLATE = '%(.{' + ','.join(INFO_FIELDS) + '})j'
+FORMATS_TEMPLATE = '%(formats.:.{' + ','.join(FORMAT_FIELDS) + '})j'
+
+
+def log(message):
+    """诊断信息输出到stderr，stdout只保留JSON结果"""
+    print(message, file=sys.stderr)
+
+
+@lru_cache(maxsize=None)
+def is_ytdlp_available():
+    """检查yt-dlp库是否已安装（每个进程只检查一次）"""
+    return find_spec('yt_dlp') is not None
+
+
+@lru_cache(maxsize=None)
+def is_ytdlp_cli_available():
+    """检查yt-dlp命令行是否可用（每个进程只检查一次）"""
+    try:
+        subprocess.run(['python', '-m', 'yt_dlp', '--version'],
+                       capture_output=True, check=True)
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+
+
+def _extract_with_library(url):
+    """
+    在当前进程中调用yt-dlp库，选项与命令行模式一致
+    返回 (视频信息, 错误输出)，二者有且只有一个不为None
+    """
+    import yt_dlp
+
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'nocheckcertificate': True,
+        'http_headers': {'User-Agent': USER_AGENT},
+        'sleep_interval': 1,
+        'max_sleep_interval': 5,
+        'extractor_retries': 3,
+        'fragment_retries': 3,
+        # 等同于 --retry-sleep linear=1::2
+        'retry_sleep_functions': {'http': lambda n: 1 + 2 * n},
+    }
+    if COOKIES_PATH.exists():
+        ydl_opts['cookiefile'] = str(COOKIES_PATH)
+
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            return ydl.extract_info(url, download=False), None
+    except yt_dlp.utils.DownloadError as e:
+        return None, str(e)
+
+
+def _run_ytdlp_subprocess(url):
+    """
+    通过yt-dlp命令行获取信息
+    只让yt-dlp输出需要的字段（元数据一行、格式子集一行），逐行读取并解析，
+    不缓冲完整的--print-json输出（字幕、缩略图、分片列表等可达数MB）
+    返回 (视频信息, 错误输出)，二者有且只有一个不为None
+    """
+    cmd = ['python', '-m', 'yt_dlp', '--skip-download',
+           '--print', INFO_TEMPLATE, '--print', FORMATS_TEMPLATE]
+    if COOKIES_PATH.exists():
+        cmd.extend(['--cookies', str(COOKIES_PATH)])
+
+    # 添加其他选项来避免限制
+    cmd.extend([
+        '--no-check-certificate',
+        '--user-agent', USER_AGENT,
+        '--sleep-interval', '1',
+        '--max-sleep-interval', '5',
+        '--extractor-retries', '3',
+        '--fragment-retries', '3',
+        '--retry-sleep', 'linear=1::2',
+        url
+    ])
+
+    log(f"执行命令: {' '.join(cmd)}")
+    with tempfile.TemporaryFile(mode='w+', encoding='utf-8') as stderr_file:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file,
+                                   text=True, encoding='utf-8')
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(SUBPROCESS_TIMEOUT, kill)
+        timer.start()
+        try:
+            lines = [line for line in process.stdout if line.strip()]
+            returncode = process.wait()
+        finally:
+            timer.cancel()
+            process.stdout.close()
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, SUBPROCESS_TIMEOUT)
+        if returncode != 0:
+            stderr_file.seek(0)
+            return None, stderr_file.read()
+
+    lines = [json.loads(line) for line in lines]
+    if len(lines) != 2 or not isinstance(lines[0], dict):
+        raise json.JSONDecodeError('Unexpected yt-dlp output', str(lines)[:500], 0)
+    video_data, formats = lines
+    video_data['formats'] = formats if isinstance(formats, list) else []
+    return video_data, None
+
+
+def _classify_error(error_output):
+    """根据yt-dlp的错误输出生成错误结果"""
+    if 'HTTP Error 429' in error_output:
+        return {
+            'success': False,
+            'error': 'Too many requests. Please try again later or use cookies.',
+            'error_type': 'rate_limited',
+            'details': error_output
+        }
+    elif 'Sign in to confirm' in error_output:
+        return {
+            'success': False,
+            'error': 'YouTube requires sign-in. Please provide valid cookies.',
+            'error_type': 'auth_required',
+            'details': error_output
+        }
+    elif 'Video unavailable' in error_output:
+        return {
+            'success': False,
+            'error': 'Video is unavailable',
+            'error_type': 'unavailable',
+            'details': error_output
+        }
+    else:
+        return {
+            'success': False,
+            'error': f'yt-dlp failed: {error_output}',
+            'error_type': 'ytdlp_error',
+            'details': error_output
+        }
+
+
+def _build_video_info(video_data):
+    """把yt-dlp的信息转换为统一格式"""
+    # 转换为统一格式
+    video_info = {
+        'success': True,
+        'title': video_data.get('title', 'Unknown'),
+        'length': video_data.get('duration', 0),
+        'views': video_data.get('view_count', 0),
+        'rating': video_data.get('average_rating'),
+        'author': video_data.get('uploader', 'Unknown'),
+        'description': video_data.get('description', '')[:500] + '...' if video_data.get('description', '') else '',
+        'thumbnail_url': video_data.get('thumbnail'),
+        'publish_date': video_data.get('upload_date'),
+        'video_id': video_data.get('id'),
+        'channel_url': video_data.get('uploader_url'),
+        'keywords': video_data.get('tags', [])[:10],
+    }
+
+    # 整理流信息
+    video_info.update(normalize_streams(stream_from_ytdlp(fmt) for fmt in video_data.get('formats') or []))
+
+    return video_info
+
+
+def get_video_info_with_ytdlp(url, use_subprocess=None):
     """使用yt-dlp获取YouTube视频信息"""
     try:
+        use_subprocess = USE_SUBPROCESS if use_subprocess is None else use_subprocess
+
         # 检查yt-dlp是否可用
-        try:
-            subprocess.run(['python', '-m', 'yt_dlp', '--version'],
-                         capture_output=True, check=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
+        if not (is_ytdlp_cli_available() if use_subprocess else is_ytdlp_available()):
             return {
                 'success': False,
                 'error': 'yt-dlp not available',
@@ -26,180 +212,43 @@ def get_video_info_with_ytdlp(url):
                 'details': 'Please install yt-dlp: pip install yt-dlp'
             }
 
-        # 构建yt-dlp命令
-        cmd = ['python', '-m', 'yt_dlp', '--print-json', '--skip-download']
-
-        # 检查cookies文件
-        cookies_path = Path(__file__).parent.parent / 'config' / 'cookies.txt'
-        if cookies_path.exists():
-            cmd.extend(['--cookies', str(cookies_path)])
-            print(f"使用cookies文件: {cookies_path}")
+        if COOKIES_PATH.exists():
+            log(f"使用cookies文件: {COOKIES_PATH}")
         else:
-            print("未找到cookies文件，使用无认证模式")
-
-        # 添加其他选项来避免限制
-        cmd.extend([
-            '--no-check-certificate',
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            '--sleep-interval', '1',
-            '--max-sleep-interval', '5',
-            '--extractor-retries', '3',
-            '--fragment-retries', '3',
-            '--retry-sleep', 'linear=1::2',
-            url
-        ])
-
-        print(f"执行命令: {' '.join(cmd)}")
-
-        # 执行命令
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-
-        if result.returncode != 0:
-            error_output = result.stderr
-            print(f"yt-dlp错误输出: {error_output}")
-
-            # 分析错误类型
-            if 'HTTP Error 429' in error_output:
-                return {
-                    'success': False,
-                    'error': 'Too many requests. Please try again later or use cookies.',
-                    'error_type': 'rate_limited',
-                    'details': error_output
-                }
-            elif 'Sign in to confirm' in error_output:
-                return {
-                    'success': False,
-                    'error': 'YouTube requires sign-in. Please provide valid cookies.',
-                    'error_type': 'auth_required',
-                    'details': error_output
-                }
-            elif 'Video unavailable' in error_output:
-                return {
-                    'success': False,
-                    'error': 'Video is unavailable',
-                    'error_type': 'unavailable',
-                    'details': error_output
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': f'yt-dlp failed: {error_output}',
-                    'error_type': 'ytdlp_error',
-                    'details': error_output
-                }
-
-        # 解析JSON输出
+            log("未找到cookies文件，使用无认证模式")
+
+        # 在共享限流器下执行请求，被限流期间排队等待
+        limiter = get_default_limiter()
+        if limiter:
+            limiter.acquire()
         try:
-            video_data = json.loads(result.stdout)
+            if use_subprocess:
+                video_data, error_output = _run_ytdlp_subprocess(url)
+            else:
+                video_data, error_output = _extract_with_library(url)
         except json.JSONDecodeError as e:
             return {
                 'success': False,
                 'error': f'Failed to parse yt-dlp output: {e}',
                 'error_type': 'parse_error',
-                'details': result.stdout
+                'details': e.doc
             }
+        if limiter:
+            limiter.report(error_output is None, error_output)
 
-        # 转换为统一格式
-        video_info = {
-            'success': True,
-            'title': video_data.get('title', 'Unknown'),
-            'length': video_data.get('duration', 0),
-            'views': video_data.get('view_count', 0),
-            'rating': video_data.get('average_rating'),
-            'author': video_data.get('uploader', 'Unknown'),
-            'description': video_data.get('description', '')[:500] + '...' if video_data.get('description', '') else '',
-            'thumbnail_url': video_data.get('thumbnail'),
-            'publish_date': video_data.get('upload_date'),
-            'video_id': video_data.get('id'),
-            'channel_url': video_data.get('uploader_url'),
-            'keywords': video_data.get('tags', [])[:10],
-        }
+        if error_output is not None:
+            log(f"yt-dlp错误输出: {error_output}")
+            return _classify_error(error_output)
 
-        # 处理格式信息
-        formats = video_data.get('formats', [])
-
-        streams_data = []
-        audio_streams = []
-        video_streams = []
-
-        for fmt in formats:
-            stream_info = {
-                'itag': fmt.get('format_id'),
-                'mime_type': fmt.get('ext'),
-                'type': 'video' if fmt.get('vcodec') != 'none' else 'audio',
-                'subtype': fmt.get('ext'),
-                'filesize': fmt.get('filesize', 0),
-                'filesize_mb': round(fmt.get('filesize', 0) / 1024 / 1024, 2) if fmt.get('filesize') else 0,
-                'is_progressive': fmt.get('acodec') != 'none' and fmt.get('vcodec') != 'none',
-                'includes_audio_track': fmt.get('acodec') != 'none',
-                'includes_video_track': fmt.get('vcodec') != 'none',
-            }
+        return _build_video_info(video_data)
 
-            # 视频流信息
-            if fmt.get('vcodec') != 'none':
-                stream_info.update({
-                    'resolution': f"{fmt.get('height', 0)}p" if fmt.get('height') else None,
-                    'fps': fmt.get('fps'),
-                    'video_codec': fmt.get('vcodec'),
-                })
-                video_streams.append(stream_info)
-
-            # 音频流信息
-            if fmt.get('acodec') != 'none' and fmt.get('vcodec') == 'none':
-                stream_info.update({
-                    'abr': f"{fmt.get('abr', 0)}kbps" if fmt.get('abr') else None,
-                    'audio_codec': fmt.get('acodec'),
-                })
-                audio_streams.append(stream_info)
-
-            streams_data.append(stream_info)
-
-        # 按质量排序
-        video_streams.sort(key=lambda x: int(x['resolution'][:-1]) if x['resolution'] else 0, reverse=True)
-        audio_streams.sort(key=lambda x: int(x['abr'][:-4]) if x['abr'] else 0, reverse=True)
-
-        video_info['streams'] = {
-            'all': streams_data,
-            'video_only': [s for s in video_streams if not s['includes_audio_track']],
-            'audio_only': audio_streams,
-            'progressive': [s for s in video_streams if s['is_progressive']],
+    except RateLimitTimeout as e:
+        return {
+            'success': False,
+            'error': 'Too many requests. Please try again later or use cookies.',
+            'error_type': 'rate_limited',
+            'details': str(e)
         }
-
-        # 推荐格式
-        recommended = []
-
-        # 推荐1：最佳progressive流
-        best_progressive = None
-        for stream in video_streams:
-            if stream['is_progressive'] and stream['resolution']:
-                best_progressive = stream
-                break
-
-        if best_progressive:
-            recommended.append({
-                'id': 'best_progressive',
-                'name': '推荐：最佳质量（音视频合并）',
-                'itag': best_progressive['itag'],
-                'description': f"{best_progressive['resolution']} {best_progressive['subtype']}格式",
-                'type': 'progressive'
-            })
-
-        # 推荐2：720p progressive
-        for stream in video_streams:
-            if stream['is_progressive'] and stream['resolution'] == '720p':
-                recommended.append({
-                    'id': '720p_progressive',
-                    'name': '推荐：720p高清',
-                    'itag': stream['itag'],
-                    'description': f"720p {stream['subtype']}格式，兼容性好",
-                    'type': 'progressive'
-                })
-                break
-
-        video_info['recommended'] = recommended
-
-        return video_info
-
     except subprocess.TimeoutExpired:
         return {
             'success': False,
@@ -217,16 +266,31 @@ def get_video_info_with_ytdlp(url):
 
 def main():
     """主函数"""
-    if len(sys.argv) != 2:
+    try:
+        output_format, args = pop_format_arg(sys.argv[1:])
+    except OutputFormatError as e:
+        print(json.dumps({
+            'success': False,
+            'error': str(e),
+            'error_type': 'invalid_format'
+        }))
+        sys.exit(1)
+
+    use_subprocess = None
+    if '--subprocess' in args:
+        args.remove('--subprocess')
+        use_subprocess = True
+
+    if len(args) != 1:
         print(json.dumps({
             'success': False,
-            'error': 'Usage: python youtube_info_ytdlp.py <youtube_url>'
+            'error': 'Usage: python youtube_info_ytdlp.py [--subprocess] [--format=json|compact-json|ndjson|msgpack] <youtube_url>'
         }))
         sys.exit(1)
 
-    url = sys.argv[1]
-    result = get_video_info_with_ytdlp(url)
-    print(json.dumps(result, ensure_ascii=False, indent=2))
+    url = args[0]
+    result = get_video_info_with_ytdlp(url, use_subprocess)
+    write_result(result, output_format)
 
 if __name__ == '__main__':
     main()
@@ -11,14 +11,23 @@ const YOUTUBE_INFO_SCRIPT = path.join(__dirname, '../../../scripts/youtube_info.
 const YOUTUBE_INFO_YTDLP_SCRIPT = path.join(__dirname, '../../../scripts/youtube_info_ytdlp.py');
 const YOUTUBE_DOWNLOAD_SCRIPT = path.join(__dirname, '../../../scripts/youtube_downloader.py');
 const YEWTUBE_SERVICE_SCRIPT = path.join(__dirname, '../../../scripts/yewtube_service.py');
+const DOWNLOAD_STORE_SCRIPT = path.join(__dirname, '../../../scripts/download_store.py');
 const TEMP_DIR = path.join(__dirname, '../../../temp');
 const COOKIES_PATH = path.join(__dirname, '../../../config/cookies.txt');
+// 与thumbnail_cache.py使用相同的缓存目录和标准宽度
+const THUMBNAIL_IMAGES_DIR = path.join(
+  process.env.THUMBNAIL_CACHE_DIR || path.join(__dirname, '../../../cache/thumbnails'), 'images');
+const THUMBNAIL_WIDTHS = (process.env.THUMBNAIL_WIDTHS || '120,320,480')
+  .split(',').filter(w => w.trim()).map(Number).sort((a, b) => a - b);
 
 // 确保临时目录存在
 if (!fs.existsSync(TEMP_DIR)) {
   fs.mkdirSync(TEMP_DIR, { recursive: true });
 }
 
+// 临时目录中的文件名（每次导出唯一）-> 下载存储租约（文件清理后释放；未释放的租约到期后自动失效）
+const storeLeases = new Map();
+
 /**
  * 解析YouTube视频信息
  */
@@ -224,6 +233,11 @@ router.post('/download', async (req, res) => {
     if (result.success) {
       logger.info('YouTube视频下载成功:', result.filename);
 
+      // 文件来自共享下载存储时，记录租约，文件被取走并清理后释放
+      if (result.store_lease) {
+        storeLeases.set(result.filename, result.store_lease);
+      }
+
       res.json({
         success: true,
         result: {
@@ -404,6 +418,7 @@ router.get('/file/:filename', (req, res) => {
             fs.unlinkSync(filePath);
             logger.info('清理YouTube下载文件:', filename);
           }
+          releaseStoreEntry(filename);
         } catch (error) {
           logger.error('清理文件失败:', error);
         }
@@ -427,6 +442,213 @@ router.get('/file/:filename', (req, res) => {
   }
 });
 
+/**
+ * 把请求的宽度归到标准宽度（与thumbnail_cache.normalize_width一致，Pillow是否可用由说明文件决定）
+ */
+function normalizeThumbnailWidth(width) {
+  if (!width) {
+    return 0;
+  }
+  const standard = THUMBNAIL_WIDTHS.find(w => width <= w);
+  return standard !== undefined ? standard : (THUMBNAIL_WIDTHS[THUMBNAIL_WIDTHS.length - 1] || 0);
+}
+
+/**
+ * 在缓存目录中查找未过期的缩略图，未命中返回null
+ * 每张图片旁的<文件>.json说明文件记录类型和过期时间；未安装Pillow时所有宽度都缓存为原图（宽度0）
+ */
+async function findCachedThumbnail(key, width) {
+  const candidates = [normalizeThumbnailWidth(width)];
+  if (candidates[0] !== 0) {
+    candidates.push(0);
+  }
+
+  for (const candidate of candidates) {
+    const imagePath = path.join(THUMBNAIL_IMAGES_DIR, `${key}_${candidate}`);
+    let meta;
+    try {
+      meta = JSON.parse(await fs.promises.readFile(`${imagePath}.json`, 'utf8'));
+    } catch (error) {
+      continue;
+    }
+    if (candidate !== candidates[0] && meta.pillow !== false) {
+      continue;
+    }
+    if (meta.expires_at * 1000 <= Date.now()) {
+      return null;
+    }
+    try {
+      // 更新修改时间，thumbnail_cache.py淘汰时据此判断最近访问
+      const now = new Date();
+      await fs.promises.utimes(imagePath, now, now);
+    } catch (error) {
+      continue;
+    }
+    return { success: true, path: imagePath, content_type: meta.content_type, status: 'hit' };
+  }
+  return null;
+}
+
+/**
+ * 提供缩略图（YouTube和爱奇艺共用）
+ * 未过期的缓存由Node直接读取；未命中、过期或需要缩放时交给常驻工作进程中的thumbnail_cache.py
+ */
+router.get('/thumbnail/:key', async (req, res) => {
+  try {
+    const { key } = req.params;
+    const width = req.query.w || '320';
+
+    if (!/^[0-9a-f]{32}$/.test(key) || !/^\d{1,4}$/.test(width)) {
+      return res.status(400).json({
+        success: false,
+        error: '无效的缩略图参数'
+      });
+    }
+
+    const result = await findCachedThumbnail(key, Number(width)) ||
+      await callServiceWorker('thumbnail', [key, width]);
+
+    if (!result.success) {
+      return res.status(404).json(result);
+    }
+
+    res.setHeader('Content-Type', result.content_type);
+    res.setHeader('Cache-Control', 'public, max-age=86400');
+    res.sendFile(result.path, (error) => {
+      if (error && !res.headersSent) {
+        logger.error('缩略图发送失败:', error);
+        res.status(500).json({
+          success: false,
+          error: '缩略图读取失败'
+        });
+      }
+    });
+
+  } catch (error) {
+    logger.error('获取缩略图失败:', error);
+    res.status(500).json({
+      success: false,
+      error: '服务器内部错误'
+    });
+  }
+});
+
+/**
+ * 释放下载存储中的租约（导出的文件已清理），失败只记录日志
+ */
+function releaseStoreEntry(filename) {
+  const lease = storeLeases.get(filename);
+  if (!lease) {
+    return;
+  }
+  storeLeases.delete(filename);
+  callPythonScript(DOWNLOAD_STORE_SCRIPT, ['release', lease]).catch((error) => {
+    logger.error('释放下载存储租约失败:', { lease, error: error.message });
+  });
+}
+
+// 常驻的yewtube_service.py工作进程（serve模式），首次使用时启动，退出后下次调用时重新启动
+let serviceWorker = null;
+// 单个请求的超时时间（毫秒），连续超时达到上限时认为工作进程已卡住并重启
+const SERVICE_WORKER_TIMEOUT = Number(process.env.SERVICE_WORKER_TIMEOUT) || 30000;
+const SERVICE_WORKER_MAX_TIMEOUTS = 3;
+
+/**
+ * 启动常驻工作进程，请求和响应都是带id的JSON行
+ */
+function startServiceWorker() {
+  const python = spawn('python', [YEWTUBE_SERVICE_SCRIPT, 'serve']);
+  const worker = { python, pending: new Map(), nextId: 1, buffer: '', timeouts: 0 };
+
+  python.stdout.on('data', (data) => {
+    worker.buffer += data.toString();
+    const lines = worker.buffer.split('\n');
+    worker.buffer = lines.pop();
+
+    for (const line of lines) {
+      let message;
+      try {
+        message = JSON.parse(line);
+      } catch (error) {
+        continue;
+      }
+      // 忽略ready和进度事件
+      if (message.type !== 'result' || !worker.pending.has(message.id)) {
+        continue;
+      }
+      const request = worker.pending.get(message.id);
+      worker.pending.delete(message.id);
+      clearTimeout(request.timer);
+      worker.timeouts = 0;
+      request.resolve(message.result);
+    }
+  });
+
+  python.stderr.on('data', (data) => {
+    logger.debug('常驻工作进程输出:', data.toString());
+  });
+
+  const fail = (error) => {
+    if (serviceWorker === worker) {
+      serviceWorker = null;
+    }
+    for (const { reject, timer } of worker.pending.values()) {
+      clearTimeout(timer);
+      reject(error);
+    }
+    worker.pending.clear();
+  };
+
+  python.on('close', (code) => {
+    logger.error('常驻工作进程退出:', { code });
+    fail(new Error(`Service worker exited with code ${code}`));
+  });
+
+  python.on('error', (error) => {
+    logger.error('常驻工作进程启动失败:', error);
+    fail(error);
+  });
+
+  return worker;
+}
+
+/**
+ * 通过常驻工作进程执行命令，不为每次请求启动新的Python进程
+ */
+function callServiceWorker(cmd, args) {
+  if (!serviceWorker) {
+    serviceWorker = startServiceWorker();
+  }
+  const worker = serviceWorker;
+
+  return new Promise((resolve, reject) => {
+    const id = worker.nextId++;
+    const timer = setTimeout(() => {
+      if (!worker.pending.delete(id)) {
+        return;
+      }
+      reject(new Error(`Service worker request timed out: ${cmd}`));
+      worker.timeouts += 1;
+      if (worker.timeouts === SERVICE_WORKER_MAX_TIMEOUTS) {
+        // 连续超时：结束卡住的进程，其余等待中的请求在进程退出时失败，下次调用时重新启动
+        logger.error('常驻工作进程连续超时，重新启动:', { timeouts: worker.timeouts });
+        if (serviceWorker === worker) {
+          serviceWorker = null;
+        }
+        worker.python.kill();
+      }
+    }, SERVICE_WORKER_TIMEOUT);
+
+    worker.pending.set(id, { resolve, reject, timer });
+    worker.python.stdin.write(JSON.stringify({ id, cmd, args }) + '\n', (error) => {
+      if (error && worker.pending.delete(id)) {
+        clearTimeout(timer);
+        reject(error);
+      }
+    });
+  });
+}
+
 /**
  * 调用Python脚本
  */